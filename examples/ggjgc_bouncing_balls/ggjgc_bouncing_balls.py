@@ -10,7 +10,7 @@ import numpy
 # import scipy
 # import sys
 
-from matts_tree_helpers import get_coords_pixels, FrameManager
+from matts_tree_helpers import get_coords_pixels, FrameManager, SpatialIndex
 
 
 def bouncing_balls():
@@ -50,20 +50,18 @@ def bouncing_balls():
 
     ball_colours = [hue_to_grb(i / ball_count) for i in range(ball_count)]
 
+    # used to quickly find the LEDs inside each ball
+    spatial_index = SpatialIndex(coords)
+
     while True:
         with FrameManager(frame_time):
             # find which ball each pixel is in (if any)
-            for i, coord in enumerate(coords):
-                for ball_location, ball_colour in zip(ball_locations, ball_colours):
-                    if (
-                        sum((bax - cax) ** 2 for bax, cax in zip(ball_location, coord))
-                        ** 0.5
-                        < ball_radius
-                    ):
-                        pixels[i] = ball_colour
-                        break
-                else:
-                    pixels[i] = (0, 0, 0)
+            pixels.fill((0, 0, 0))
+            ball_leds = spatial_index.within_radius(ball_locations, ball_radius)
+            # if a pixel is in more than one ball the first ball wins so set them in reverse order
+            for leds, ball_colour in reversed(list(zip(ball_leds, ball_colours))):
+                for i in leds.tolist():
+                    pixels[i] = ball_colour
 
             # use the show() option as rarely as possible as it takes ages
             # do not use show() each time you change a LED but rather wait until you have changed them all
@@ -11,7 +11,7 @@ from colorsys import hsv_to_rgb as hsv_to_rgb
 # import scipy
 # import sys
 
-from matts_tree_helpers import get_coords_pixels, FrameManager
+from matts_tree_helpers import get_coords_pixels, FrameManager, SpatialIndex
 
 
 def hue_to_rgb(hue):
@@ -51,6 +51,9 @@ def fireworks():
     # the particle start position
     start = tuple(sum(ax)/len(coords) for ax in zip(*coords))
 
+    # used to quickly find the LED nearest to each particle
+    spatial_index = SpatialIndex(coords)
+
     while True:
         colours = [hue_to_rgb(random.random()) for _ in range(3)]
         particles = []
@@ -71,20 +74,15 @@ def fireworks():
         while firework_has_particles:
             with FrameManager(frame_time):
                 # turn all the LEDs to off
-                for i in range(len(coords)):
-                    pixels[i] = (0, 0, 0)
+                pixels.fill((0, 0, 0))
 
                 firework_has_particles = False
                 # find which LED each particle is closest to
-                for particle in particles:
-                    dist = tree_height * 10
-                    led = None
-                    for i, coord in enumerate(coords):
-                        led_dist = sum((c2 - c1) ** 2 for c1, c2 in zip(coord, particle.position)) ** 0.5
-                        if led_dist < particle_distance and led_dist < dist:
-                            led = i
-                            dist = led_dist
-                    if led is not None:
+                leds = spatial_index.nearest(
+                    [particle.position for particle in particles], particle_distance
+                )
+                for particle, led in zip(particles, leds.tolist()):
+                    if led != -1:
                         pixels[led] = particle.colour
                         firework_has_particles = True
 
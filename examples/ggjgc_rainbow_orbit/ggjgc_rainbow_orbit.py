@@ -1,15 +1,24 @@
 # Here are the libraries I am currently using:
-import time
-from colorsys import hsv_to_rgb
-import math
+import numpy
 
 # You are welcome to add any of these:
+# import time
+# import math
 # import random
-# import numpy
 # import scipy
 # import sys
 
-from matts_tree_helpers import get_coords_pixels, FrameManager
+from matts_tree_helpers import get_coords_pixels, run_shader, hsv_to_grb
+
+# how many times the rainbow goes round the tree per second
+SPEED = 0.2
+
+
+def rainbow_orbit_shader(tree, t):
+    # calculate the colour for every pixel at once
+    tree_angle = tree.angle / (2 * numpy.pi)
+    hue = (SPEED * t + tree_angle) % 1
+    return 255 * hsv_to_grb(hue, 1, 1)
 
 
 def rainbow_oribt():
@@ -23,23 +32,10 @@ def rainbow_oribt():
 
     # YOU CAN EDIT FROM HERE DOWN
 
-    speed = 0.2
-
     frame_time = 1 / 30
 
-    while True:
-        with FrameManager(frame_time):
-            # calculate the colour for each pixel
-            t = time.time()
-            for i, coord in enumerate(coords):
-                tree_angle = math.atan2(coord[0], coord[1]) / (2 * math.pi)
-                hue = (speed * t + tree_angle) % 1
-                rgb = hsv_to_rgb(hue, 1, 1)
-                pixels[i] = (255 * rgb[1], 255 * rgb[0], 255 * rgb[2])
-
-            # use the show() option as rarely as possible as it takes ages
-            # do not use show() each time you change a LED but rather wait until you have changed them all
-            pixels.show()
+    # the animation repeats every 1 / SPEED seconds so one cycle is computed at the start and played back
+    run_shader(rainbow_orbit_shader, coords, pixels, frame_time, period=1 / SPEED)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,21 @@
 # Here are the libraries I am currently using:
-import time
-from colorsys import hsv_to_rgb
 
 # You are welcome to add any of these:
+# import time
 # import math
 # import random
 # import numpy
 # import scipy
 # import sys
 
-from matts_tree_helpers import get_coords_pixels, FrameManager
+from matts_tree_helpers import get_coords_pixels, run_shader, hsv_to_grb
+
+
+def rainbow_scroll_shader(tree, t):
+    # calculate the colour for every pixel at once
+    speed = tree.height * 0.03
+    hue = (speed * t + tree.normalised_height) % 1
+    return 255 * hsv_to_grb(hue, 1, 1)
 
 
 def rainbow_scroll():
@@ -23,30 +29,10 @@ def rainbow_scroll():
 
     # YOU CAN EDIT FROM HERE DOWN
 
-    y_coords = list(zip(*coords))[2]
-    max_y = max(y_coords)
-    min_y = min(y_coords)
-    speed = (max_y - min_y) * 0.03
-
     frame_time = 1 / 30
 
-    y_coords = list(zip(*coords))[2]
-    max_y = max(y_coords)
-    min_y = min(y_coords)
-
-    while True:
-        with FrameManager(frame_time):
-            # calculate the colour for each pixel
-            t = time.time()
-            for i, coord in enumerate(coords):
-                tree_offset = (coord[2] - min_y) / (max_y - min_y)
-                hue = (speed * t + tree_offset) % 1
-                rgb = hsv_to_rgb(hue, 1, 1)
-                pixels[i] = (255 * rgb[1], 255 * rgb[0], 255 * rgb[2])
-
-            # use the show() option as rarely as possible as it takes ages
-            # do not use show() each time you change a LED but rather wait until you have changed them all
-            pixels.show()
+    # the shader is called once per frame and the result is shown on the tree
+    run_shader(rainbow_scroll_shader, coords, pixels, frame_time)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,29 @@
 # Here are the libraries I am currently using:
-import time
-from colorsys import hsv_to_rgb
-import math
+import numpy
 
 # You are welcome to add any of these:
+# import time
+# import math
 # import random
-# import numpy
 # import scipy
 # import sys
 
-from matts_tree_helpers import get_coords_pixels, FrameManager
+from matts_tree_helpers import get_coords_pixels, run_shader, hsv_to_grb
+
+SPEED = 0.1
+TURNS = 3
+
+
+def rainbow_spiral_shader(tree, t):
+    # calculate the colour for every pixel at once
+    tree_angle = tree.angle / (2 * numpy.pi)
+    # I don't fully understand this. I just wrote code until I got it to work
+    hue = (
+        numpy.trunc(tree_angle + tree.normalised_height * TURNS) / TURNS
+        - SPEED * t
+        - tree_angle / TURNS
+    )
+    return 255 * hsv_to_grb(hue % 1, 1, 1)
 
 
 def rainbow_spiral():
@@ -23,35 +37,10 @@ def rainbow_spiral():
 
     # YOU CAN EDIT FROM HERE DOWN
 
-    speed = 0.1
-
     frame_time = 1 / 30
 
-    y_coords = list(zip(*coords))[2]
-    max_y = max(y_coords)
-    min_y = min(y_coords)
-
-    turns = 3
-
-    while True:
-        with FrameManager(frame_time):
-            # calculate the colour for each pixel
-            t = time.time()
-            for i, coord in enumerate(coords):
-                tree_offset = (coord[2] - min_y) / (max_y - min_y)
-                tree_angle = math.atan2(coord[0], coord[1]) / (2 * math.pi)
-                # I don't fully understand this. I just wrote code until I got it to work
-                hue = (
-                    int(tree_angle + tree_offset * turns) / turns
-                    - speed * t
-                    - tree_angle / turns
-                )
-                rgb = hsv_to_rgb(hue % 1, 1, 1)
-                pixels[i] = (255 * rgb[1], 255 * rgb[0], 255 * rgb[2])
-
-            # use the show() option as rarely as possible as it takes ages
-            # do not use show() each time you change a LED but rather wait until you have changed them all
-            pixels.show()
+    # the animation repeats every 1 / SPEED seconds so one cycle is computed at the start and played back
+    run_shader(rainbow_spiral_shader, coords, pixels, frame_time, period=1 / SPEED)
 
 
 if __name__ == "__main__":
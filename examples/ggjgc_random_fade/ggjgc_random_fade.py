@@ -1,11 +1,10 @@
 # Here are the libraries I am currently using:
-import random
+import numpy
 
 # You are welcome to add any of these:
 # import time
 # import math
 # import random
-# import numpy
 # import scipy
 # import sys
 
@@ -26,26 +25,24 @@ def random_fade():
     frame_time = 1 / 30
     fade_frame_count = 60
 
-    last_colours = [(0, 0, 0)] * len(coords)
+    last_colours = numpy.zeros((len(coords), 3))
 
     while True:
-        next_colours = [
-            tuple(random.randint(0, 255) for _ in range(3)) for _ in range(len(coords))
-        ]
+        next_colours = numpy.random.randint(0, 256, (len(coords), 3)).astype(float)
         for frame_index in range(fade_frame_count):
             with FrameManager(frame_time):
                 lerp = frame_index / fade_frame_count
 
-                # calculate the colour for each pixel
-                for i in range(len(coords)):
-                    pixels[i] = tuple(
-                        min(
-                            last_colours[i][channel] * (1 - lerp)
-                            + next_colours[i][channel] * lerp,
-                            255.0,
-                        )
-                        for channel in range(3)
-                    )
+                # calculate the colour for every pixel at once
+                colours = numpy.minimum(
+                    last_colours * (1 - lerp) + next_colours * lerp, 255.0
+                )
+                try:
+                    # The simulator can set every pixel in one call
+                    pixels.set_all(colours)
+                except AttributeError:
+                    for i, colour in enumerate(colours.tolist()):
+                        pixels[i] = colour
 
                 # use the show() option as rarely as possible as it takes ages
                 # do not use show() each time you change a LED but rather wait until you have changed them all
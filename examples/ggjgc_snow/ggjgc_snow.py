@@ -10,7 +10,7 @@ from typing import Dict, List
 # import scipy
 # import sys
 
-from matts_tree_helpers import get_coords_pixels, FrameManager
+from matts_tree_helpers import get_coords_pixels, FrameManager, SpatialIndex
 
 
 def snow():
@@ -43,23 +43,26 @@ def snow():
     pixel_colours: Dict[int, int] = dict.fromkeys(range(len(coords)), 0)
     next_leds: Dict[int, List[int]] = {}  # track which is the next LED in the chain
 
-    # precompute the closest LEDs below each led
-    for led1, coord1 in enumerate(coords):
-        # for each LED
-        led_data = []
-        for led2, coord2 in enumerate(coords):
-            if coord2[2] < coord1[2]:
-                # if it is below the current LED
-                dist = sum((c2 - c1) ** 2 for c1, c2 in zip(coord1, coord2)) ** 0.5
-                if dist < max_dist:
-                    # if within the max distance
-                    led_data.append((dist, led2))
-        led_data = sorted(led_data, key=lambda x: x[0])[:15]
-        if led_data:
-            _, leds = zip(*led_data)
-        else:
-            leds = []
-        next_leds[led1] = leds
+    # precompute the 15 closest LEDs below each led within the max distance
+    # The LEDs are searched 1000 at a time. The search starts with a small radius which is
+    # doubled for the LEDs that do not have 15 LEDs below them yet, up to the max distance.
+    spatial_index = SpatialIndex(coords)
+    for first_led in range(0, len(coords), 1000):
+        search_leds = list(range(first_led, min(first_led + 1000, len(coords))))
+        radius = max_dist / 8
+        while search_leds:
+            # the LEDs within the radius sorted by distance
+            nearby_leds = spatial_index.within_radius([coords[led] for led in search_leds], radius)
+            unfinished_leds = []
+            for led1, leds in zip(search_leds, nearby_leds):
+                below_leds = [led2 for led2 in leds.tolist() if coords[led2][2] < coords[led1][2]]
+                if len(below_leds) >= 15 or radius == max_dist:
+                    # the 15 closest that are below the current LED
+                    next_leds[led1] = below_leds[:15]
+                else:
+                    unfinished_leds.append(led1)
+            search_leds = unfinished_leds
+            radius = min(radius * 2, max_dist)
 
     # find the LEDs that are in the top half of the tree
     start_leds = [
@@ -1,14 +1,14 @@
 # Here are the libraries I am currently using:
 import math
+import numpy
 
 # You are welcome to add any of these:
 # import time
 # import random
-# import numpy
 # import scipy
 # import sys
 
-from matts_tree_helpers import get_coords_pixels, FrameManager
+from matts_tree_helpers import get_coords_pixels, FrameManager, TreeGeometry, set_pixels
 
 
 def xmaslight():
@@ -22,12 +22,13 @@ def xmaslight():
 
     # YOU CAN EDIT FROM HERE DOWN
 
-    # I get a list of the heights which is not overly useful here other than to set the max and min altitudes
-    heights = [i[2] for i in coords]
+    tree = TreeGeometry(coords)
+    y = tree.coords[:, 1]
+    z = tree.coords[:, 2]
 
     # find the height bounds
-    min_alt = min(heights)
-    max_alt = max(heights)
+    min_alt = tree.min[2]
+    max_alt = tree.max[2]
 
     # VARIOUS SETTINGS
 
@@ -48,6 +49,7 @@ def xmaslight():
     # if you are turning a lot of them on at once, keep their brightness down please
     colour_a = [0, 50, 50]  # purple
     colour_b = [50, 50, 0]  # yellow
+    colours = numpy.array([colour_b, colour_a])
 
     # INITIALISE SOME VALUES
 
@@ -59,16 +61,14 @@ def xmaslight():
     # Run forever
     while True:
         with FrameManager(frame_time):
-            # calculate the colour for each pixel
+            # calculate the colour for every pixel at once
             tan = math.tan(angle)
-            for led, coord in enumerate(coords):
-                pixels[led] = [colour_b, colour_a][
-                    # is the point above the line
-                    (tan * coord[1] + c <= coord[2])
-                    # The bit below handles flipping the colours when passing the vertical point
-                    # xor the above with if we are 1/4 to 3/4 through the rotation
-                    != (0.5 * math.pi < angle < 1.5 * math.pi)
-                ]
+            # is the point above the line
+            above = tan * y + c <= z
+            # The bit below handles flipping the colours when passing the vertical point
+            # xor the above with if we are 1/4 to 3/4 through the rotation
+            above ^= 0.5 * math.pi < angle < 1.5 * math.pi
+            set_pixels(pixels, colours[above.astype(int)])
 
             # use the show() option as rarely as possible as it takes ages
             # do not use show() each time you change a LED but rather wait until you have changed them all
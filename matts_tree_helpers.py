@@ -2,15 +2,24 @@
 This is a helper library to minimise code duplication of the setup code and make users code much simpler
 """
 
-from typing import List, Tuple
+from typing import List, Tuple, Optional, Union
+from collections import OrderedDict
 import json  # used to parse the coordinates
 import time  # used to get the current time and sleep
 import os
-import csv
+import hashlib
+import tempfile
+
+import numpy
 
 import board
 import neopixel
 
+# The directory the parsed coordinate files are cached in
+COORDS_CACHE_DIR = os.path.join(tempfile.gettempdir(), "xmastree_coords_cache")
+# The maximum memory used by the precomputed cycles of periodic shaders
+FRAME_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
 
 def get_coords_pixels(path: str):
     """
@@ -34,22 +43,470 @@ def get_neopixel_interface(coords):
 
 def get_coords(path: str) -> List[Tuple[float, float, float]]:
     """Load the LED coordinates from the file."""
-    if not os.path.isfile(path):
-        raise ValueError(f"File {path} does not exist.")
+    return load_coords(path).tolist()
+
+
+def _parse_coords(path: str) -> numpy.ndarray:
+    """Parse the coordinate file into a (n, 3) float array."""
     if path.endswith(".txt"):
         with open(path) as f:
-            coords = list(map(json.loads, f.readlines()))
+            coords = numpy.array([json.loads(line) for line in f if line.strip()], dtype=float)
     elif path.endswith(".csv"):
-        with open(path, "r", encoding="utf-8-sig") as f:
-            coords = list(csv.reader(f))
+        coords = numpy.loadtxt(path, delimiter=",", encoding="utf-8-sig", ndmin=2)
     else:
         raise ValueError(f"Unknown file_format for file {path}")
-    coords = [[float(a) for a in c] for c in coords]
-    if not all(len(c) == 3 for c in coords):
+    if coords.ndim != 2 or coords.shape[1] != 3:
         raise Exception("Invalid coord format.")
     return coords
 
 
+def load_coords(path: str) -> numpy.ndarray:
+    """
+    Load the LED coordinates from the file as a (n, 3) float numpy array.
+    The parsed coordinates are cached in COORDS_CACHE_DIR so that later loads of the same unmodified file are instant.
+    """
+    if not os.path.isfile(path):
+        raise ValueError(f"File {path} does not exist.")
+    stat = os.stat(path)
+    key = hashlib.sha1(
+        f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}".encode()
+    ).hexdigest()
+    cache_path = os.path.join(COORDS_CACHE_DIR, f"{key}.npy")
+    try:
+        return numpy.load(cache_path)
+    except (OSError, ValueError):
+        pass
+    coords = _parse_coords(path)
+    try:
+        os.makedirs(COORDS_CACHE_DIR, exist_ok=True)
+        # write to a temporary file first so other processes never read a partial file
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            numpy.save(f, coords)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # The cache is only an optimisation
+        pass
+    return coords
+
+
+class TreeGeometry:
+    """
+    Information about the shape of the tree that many animations need.
+    All values are computed once from the coordinates.
+
+    coords - (n, 3) array of the LED coordinates. z is the vertical axis.
+    min, max - (3,) arrays of the minimum and maximum of each axis.
+    height - The vertical distance between the lowest and highest LED.
+    centroid - (3,) array of the mean position of the LEDs.
+    normalised_height - (n,) array of each LED's height from 0 at the bottom to 1 at the top.
+    angle - (n,) array of each LED's angle around the vertical axis in radians (atan2(x, y)).
+    radius - (n,) array of each LED's horizontal distance from the vertical axis.
+    """
+
+    def __init__(self, coords):
+        self.coords = numpy.asarray(coords, dtype=float)
+        self.min = self.coords.min(axis=0)
+        self.max = self.coords.max(axis=0)
+        self.height = float(self.max[2] - self.min[2])
+        self.centroid = self.coords.mean(axis=0)
+        x, y, z = self.coords.T
+        self.normalised_height = (z - self.min[2]) / self.height
+        self.angle = numpy.arctan2(x, y)
+        self.radius = numpy.hypot(x, y)
+
+
+# The maximum number of LED and query point pairs SpatialIndex compares at once
+SPATIAL_INDEX_BLOCK_SIZE = 1 << 20
+
+
+def _sort_order(keys: numpy.ndarray, exact_keys) -> numpy.ndarray:
+    """
+    The indexes that sort keys.
+    If some keys are the same the order comes from numpy.lexsort of exact_keys instead so that ties are always
+    broken the same way.
+    """
+    order = numpy.argsort(keys)
+    sorted_keys = keys[order]
+    if numpy.any(sorted_keys[1:] == sorted_keys[:-1]):
+        order = numpy.lexsort(exact_keys)
+    return order
+
+
+class SpatialIndex:
+    """
+    A uniform grid over the LED coordinates for fast nearest LED and radius queries.
+    Only the grid cells that overlap the sphere around each query point are searched rather than every LED.
+    All the query points are searched at once with numpy. When the radius covers most of the tree
+    every LED is compared with each point instead.
+
+    index = SpatialIndex(coords)
+    leds = index.nearest(particle_positions, max_dist)
+    """
+
+    def __init__(self, coords, cell_size: Optional[float] = None):
+        """
+        :param coords: The (n, 3) LED coordinates.
+        :param cell_size: The smallest size of the grid cells. Defaults to a size that puts a few LEDs in each cell.
+            Larger queries use cells that are this size doubled until they are about a quarter of the radius.
+        """
+        self.coords = numpy.asarray(coords, dtype=float).reshape(-1, 3)
+        if len(self.coords):
+            self._origin = self.coords.min(axis=0)
+            self._extent = numpy.maximum(self.coords.max(axis=0) - self._origin, 1e-9)
+        else:
+            self._origin = numpy.zeros(3)
+            self._extent = numpy.full(3, 1e-9)
+        if cell_size is None:
+            cell_size = (numpy.prod(self._extent) * 4 / max(len(self.coords), 1)) ** (1 / 3)
+        self._cell_size = cell_size
+        # The x, y and z coordinates of the LEDs
+        self._columns = numpy.ascontiguousarray(self.coords.T)
+        # The grid of each cell size. They are created when a query first needs them.
+        self._grids = {}
+
+    def _grid(self, radius: float):
+        """
+        The grid used for queries of radius.
+        Returns the cell size, the number of cells along each axis, the LED indexes sorted by cell,
+        the x, y and z coordinates in the same order and the position of the first LED of each cell in them.
+        """
+        cell_size = self._cell_size
+        # Cells a quarter to half the radius fit the sphere closely without too many cells to look up
+        while cell_size * 4 <= radius:
+            cell_size *= 2
+        # limit the memory used by the cells
+        while numpy.prod(self._extent // cell_size + 1) > 4 * len(self.coords) + 27:
+            cell_size *= 2
+        if cell_size not in self._grids:
+            shape = (self._extent // cell_size).astype(numpy.int64) + 1
+            cells = numpy.minimum(
+                ((self.coords - self._origin) // cell_size).astype(numpy.int64), shape - 1
+            )
+            cell_ids = numpy.ravel_multi_index(cells.T, shape)
+            order = numpy.argsort(cell_ids, kind="stable")
+            starts = numpy.searchsorted(cell_ids[order], numpy.arange(numpy.prod(shape) + 1))
+            self._grids[cell_size] = (
+                cell_size,
+                shape,
+                order,
+                numpy.ascontiguousarray(self.coords[order].T),
+                starts,
+            )
+        return self._grids[cell_size]
+
+    def _pairs(self, points: numpy.ndarray, radius: float):
+        """
+        Find the LEDs closer than radius to the points.
+        The points are searched in blocks. Yields the first and last point of each block and the point indexes,
+        LED indexes and distances of the pairs in the block. The pairs are grouped by point in order.
+        """
+        if not len(points) or not len(self.coords):
+            return
+        cell_size, shape, order, sorted_columns, starts = self._grid(radius)
+        # the cells around a cell that can have LEDs closer than radius to a point in it
+        span = int(numpy.ceil(radius / cell_size))
+        offsets = numpy.stack(
+            numpy.meshgrid(*[numpy.arange(-span, span + 1)] * 3, indexing="ij"), axis=-1
+        ).reshape(-1, 3)
+        gaps = numpy.maximum(numpy.abs(offsets) - 1, 0) * cell_size
+        offsets = offsets[numpy.linalg.norm(gaps, axis=1) < radius]
+
+        points_per_block = max(1, SPATIAL_INDEX_BLOCK_SIZE // len(offsets))
+        for first_point in range(0, len(points), points_per_block):
+            block_points = points[first_point : first_point + points_per_block]
+            cells = numpy.floor((block_points - self._origin) / cell_size).astype(numpy.int64)
+            cells = cells[:, None, :] + offsets
+            # cells outside the grid are empty
+            inside = numpy.all((cells >= 0) & (cells < shape), axis=2)
+            cell_ids = numpy.ravel_multi_index(
+                numpy.where(inside[..., None], cells, 0).transpose(2, 0, 1), shape
+            )
+            cell_starts = numpy.where(inside, starts[cell_ids], 0)
+            cell_counts = numpy.where(inside, starts[cell_ids + 1], 0) - cell_starts
+            point_counts = cell_counts.sum(axis=1)
+            full_scan = point_counts.sum() * 3 > len(block_points) * len(self.coords)
+            if full_scan:
+                # The cells hold most of the LEDs so it is quicker to compare the points with every LED
+                rows = max(1, SPATIAL_INDEX_BLOCK_SIZE // len(self.coords))
+                bounds = list(range(0, len(block_points), rows)) + [len(block_points)]
+            else:
+                # limit the number of pairs compared at once
+                blocks = (numpy.cumsum(point_counts) - point_counts) // SPATIAL_INDEX_BLOCK_SIZE
+                bounds = [0, *(numpy.flatnonzero(numpy.diff(blocks)) + 1).tolist(), len(block_points)]
+            for block_start, block_end in zip(bounds[:-1], bounds[1:]):
+                if full_scan:
+                    # the distances are computed one axis at a time to avoid a large temporary array
+                    square_dist = 0
+                    for axis in range(3):
+                        square_dist = (
+                            square_dist
+                            + (self._columns[axis] - block_points[block_start:block_end, axis, None]) ** 2
+                        )
+                    dist = numpy.sqrt(square_dist).ravel()
+                    close = numpy.flatnonzero(dist < radius)
+                    point_indexes, leds = numpy.divmod(close, len(self.coords))
+                    dist = dist[close]
+                    point_indexes += block_start
+                else:
+                    counts = cell_counts[block_start:block_end].ravel()
+                    pair_cells = numpy.repeat(numpy.arange(len(counts)), counts)
+                    # the position of each LED in the LEDs sorted by cell
+                    positions = (
+                        numpy.arange(len(pair_cells))
+                        - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+                        + numpy.repeat(cell_starts[block_start:block_end].ravel(), counts)
+                    )
+                    point_indexes = pair_cells // len(offsets) + block_start
+                    square_dist = 0
+                    for axis in range(3):
+                        square_dist = (
+                            square_dist
+                            + (sorted_columns[axis, positions] - block_points[point_indexes, axis]) ** 2
+                        )
+                    dist = numpy.sqrt(square_dist)
+                    close = dist < radius
+                    point_indexes, leds, dist = point_indexes[close], order[positions[close]], dist[close]
+                yield first_point + block_start, first_point + block_end, point_indexes + first_point, leds, dist
+
+    def within_radius(self, points, radius: float) -> List[numpy.ndarray]:
+        """
+        Find the LEDs closer than radius to each point.
+        Returns an array of LED indexes for each point sorted from nearest to furthest.
+        """
+        points = numpy.asarray(points, dtype=float).reshape(-1, 3)
+        result = []
+        for block_start, block_end, point_indexes, leds, dist in self._pairs(points, radius):
+            counts = numpy.bincount(point_indexes - block_start, minlength=block_end - block_start)
+            if len(leds) > 1000 * len(counts):
+                # Each point has a lot of LEDs. They are quicker to sort one point at a time.
+                ends = numpy.cumsum(counts).tolist()
+                for start, end in zip([0] + ends[:-1], ends):
+                    point_leds = leds[start:end]
+                    point_dist = dist[start:end]
+                    result.append(point_leds[_sort_order(point_dist, (point_leds, point_dist))])
+            else:
+                # Sort by point then distance with one key. The distances are less than radius
+                # so the keys of each point are between its index and the next index.
+                pair_order = _sort_order(
+                    point_indexes + dist / radius, (leds, dist, point_indexes)
+                )
+                result += numpy.split(leds[pair_order], numpy.cumsum(counts)[:-1])
+        return result
+
+    def nearest(self, points, max_dist: float) -> numpy.ndarray:
+        """
+        Find the nearest LED to each point.
+        Returns an array of LED indexes. The index is -1 if there are no LEDs closer than max_dist to the point.
+        If two LEDs are as near the one with the lower index is found.
+        """
+        points = numpy.asarray(points, dtype=float).reshape(-1, 3)
+        result = numpy.full(len(points), -1, dtype=numpy.int64)
+        # The nearest LED is usually close so a small radius is searched first.
+        # It is doubled for the points that have not found an LED until it reaches max_dist.
+        radius = min(self._cell_size, max_dist)
+        searching = numpy.arange(len(points))
+        while len(searching):
+            for _, _, point_indexes, leds, dist in self._pairs(points[searching], radius):
+                if not len(leds):
+                    continue
+                # the pairs of each point are next to each other
+                firsts = numpy.flatnonzero(numpy.diff(point_indexes, prepend=-1))
+                counts = numpy.diff(firsts, append=len(leds))
+                nearest_dist = numpy.repeat(numpy.minimum.reduceat(dist, firsts), counts)
+                result[searching[point_indexes[firsts]]] = numpy.minimum.reduceat(
+                    numpy.where(dist == nearest_dist, leds, len(self.coords)), firsts
+                )
+            if radius >= max_dist:
+                break
+            searching = searching[result[searching] == -1]
+            radius = min(radius * 2, max_dist)
+        return result
+
+
+def hsv_to_rgb(h, s, v) -> numpy.ndarray:
+    """
+    A vectorised version of colorsys.hsv_to_rgb.
+    h, s and v can be numbers or arrays of the same shape. All values are in the range 0-1.
+    Returns an array with a trailing axis of length 3 containing the red, green and blue values in the range 0-1.
+    """
+    h, s, v = numpy.broadcast_arrays(
+        numpy.asarray(h, dtype=float),
+        numpy.asarray(s, dtype=float),
+        numpy.asarray(v, dtype=float),
+    )
+    i = numpy.trunc(h * 6.0)
+    f = h * 6.0 - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = (i % 6).astype(int)
+    r = numpy.choose(i, [v, q, p, p, t, v])
+    g = numpy.choose(i, [t, v, v, q, p, p])
+    b = numpy.choose(i, [p, p, t, v, v, q])
+    rgb = numpy.stack([r, g, b], axis=-1)
+    # colorsys returns v for all channels when there is no saturation
+    grey = s == 0.0
+    rgb[grey] = v[grey, None]
+    return rgb
+
+
+def hsv_to_grb(h, s, v) -> numpy.ndarray:
+    """The same as hsv_to_rgb but the channels are in the green, red, blue order used by the tree."""
+    return hsv_to_rgb(h, s, v)[..., [1, 0, 2]]
+
+
+def set_pixels(pixels, colours):
+    """
+    Set every pixel from a (n, 3) array of colours in one go.
+    The simulator does this in one call. The real library sets them one at a time.
+    """
+    try:
+        pixels.set_all(colours)
+    except AttributeError:
+        for i, colour in enumerate(numpy.asarray(colours).tolist()):
+            pixels[i] = colour
+
+
+def _to_uint8(colours) -> numpy.ndarray:
+    """Clamp and truncate colour values to the uint8 range the pixels store."""
+    return numpy.clip(numpy.trunc(colours), 0, 255).astype(numpy.uint8)
+
+
+def render_frames(shader, tree: TreeGeometry, times) -> numpy.ndarray:
+    """Evaluate a shader at each time. Returns a (len(times), n, 3) uint8 array of the frames."""
+    frames = numpy.empty((len(times), len(tree.coords), 3), dtype=numpy.uint8)
+    for i, t in enumerate(times):
+        frames[i] = _to_uint8(shader(tree, float(t)))
+    return frames
+
+
+def precompute_cycle(shader, tree: TreeGeometry, period: float, frame_time: float) -> numpy.ndarray:
+    """
+    Evaluate a shader over one period.
+    Returns a (frames, n, 3) uint8 array of the frames at times 0, period / frames, ...
+    The number of frames is the period divided by the frame time rounded so that the cycle loops exactly.
+    """
+    frame_count = max(1, round(period / frame_time))
+    return render_frames(shader, tree, numpy.arange(frame_count) * period / frame_count)
+
+
+def detect_period(
+    shader, tree: TreeGeometry, frame_time: float, max_period: float = 60.0
+) -> Optional[float]:
+    """
+    Find the shortest period of a shader.
+    The shader is sampled every frame_time seconds for 2 * max_period seconds so the period must be
+    a multiple of the frame time. A period is only accepted if every sampled frame matches the frame
+    one period later, so fades and delayed starts are not mistaken for a repeat.
+    The animation must repeat from time 0. One that is still for the whole sampled time is found to have
+    a period of one frame.
+    Returns None if no period up to max_period is found.
+    """
+    max_frames = round(max_period / frame_time)
+    # the frames are compared by their hash so that they do not all need to be kept in memory
+    hashes = numpy.array(
+        [
+            hash(_to_uint8(shader(tree, i * frame_time)).tobytes())
+            for i in range(2 * max_frames + 1)
+        ]
+    )
+    for period_frames in range(1, max_frames + 1):
+        if numpy.array_equal(hashes[:-period_frames], hashes[period_frames:]):
+            return period_frames * frame_time
+    return None
+
+
+class FrameCache:
+    """
+    Stores precomputed cycles of periodic shaders so that they only need to be computed once.
+    When the cycles use more than max_bytes the least recently used are removed.
+    """
+
+    def __init__(self, max_bytes: int = FRAME_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._cycles = OrderedDict()
+
+    def get_cycle(
+        self, shader, tree: TreeGeometry, period: float, frame_time: float
+    ) -> Optional[numpy.ndarray]:
+        """
+        Get the precomputed cycle of a shader, computing it if it is not cached.
+        Returns None if one cycle would be larger than max_bytes.
+        """
+        # the coordinates are hashed so that every TreeGeometry of the same tree finds the cycle
+        coords_hash = hashlib.sha1(numpy.ascontiguousarray(tree.coords).tobytes()).hexdigest()
+        key = (shader, coords_hash, period, frame_time)
+        if key in self._cycles:
+            self._cycles.move_to_end(key)
+            return self._cycles[key]
+        frame_count = max(1, round(period / frame_time))
+        nbytes = frame_count * len(tree.coords) * 3
+        if nbytes > self.max_bytes:
+            return None
+        while self._cycles and self.nbytes + nbytes > self.max_bytes:
+            _, evicted = self._cycles.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        cycle = precompute_cycle(shader, tree, period, frame_time)
+        self._cycles[key] = cycle
+        self.nbytes += cycle.nbytes
+        return cycle
+
+    def clear(self):
+        self._cycles.clear()
+        self.nbytes = 0
+
+
+# The cache used by run_shader
+frame_cache = FrameCache()
+
+
+def run_shader(
+    shader,
+    coords,
+    pixels,
+    frame_time: float = 1 / 30,
+    period: Union[float, str, None] = None,
+):
+    """
+    Run an animation where the colour of every LED is a function of its position and the time.
+    This runs forever.
+
+    The shader is called once per frame with the TreeGeometry of the coordinates and the time from time.time().
+    It must return a (n, 3) array of colours in the range 0-255 in the pixel order (GRB on the tree).
+    Use numpy operations on the arrays in the TreeGeometry rather than looping over the LEDs.
+
+    def shader(tree: TreeGeometry, t: float):
+        hue = (0.2 * t + tree.normalised_height) % 1
+        return 255 * hsv_to_grb(hue, 1, 1)
+
+    run_shader(shader, coords, pixels)
+
+    If the animation repeats every period seconds, one cycle is computed at the start and then played back
+    so each frame only needs to be looked up. Each frame is rounded to the nearest precomputed frame.
+    Use period="auto" to find the period with detect_period.
+    If one cycle is larger than frame_cache.max_bytes the frames are computed every frame as normal.
+    """
+    tree = TreeGeometry(coords)
+    if period == "auto":
+        period = detect_period(shader, tree, frame_time)
+        if period is None:
+            print("No period found. The frames will not be cached.")
+    cycle = None
+    if period is not None:
+        cycle = frame_cache.get_cycle(shader, tree, period, frame_time)
+    while True:
+        with FrameManager(frame_time):
+            t = time.time()
+            if cycle is None:
+                set_pixels(pixels, shader(tree, t))
+            else:
+                index = round((t % period) / period * len(cycle)) % len(cycle)
+                set_pixels(pixels, cycle[index])
+            pixels.show()
+
+
 class FrameManager:
     """
     A class to help cap the frame rate. You shouldn't rely on the neopixel show method having a known delay.
@@ -67,12 +524,68 @@ class FrameManager:
 
     def __enter__(self):
         self._end_time = time.perf_counter() + self._frame_time
+        # The simulator can record how long each frame took
+        profiler = getattr(neopixel, "profiler", None)
+        if profiler is not None:
+            profiler.frame_started(self._frame_time)
+        # The simulator can warn if the real tree cannot update this fast
+        hardware_timing = getattr(neopixel, "hardware_timing", None)
+        if hardware_timing is not None:
+            hardware_timing.check_frame_time(self._frame_time)
+
+    def _frame_finished(self, exc_type):
+        profiler = getattr(neopixel, "profiler", None)
+        if profiler is not None and exc_type is None:
+            profiler.frame_finished()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self._frame_finished(exc_type)
+        # The simulator has a sleeper that does not keep the CPU busy and supports the virtual clock.
+        sleeper = getattr(neopixel, "sleeper", None)
+        if sleeper is not None:
+            sleeper.sleep_until(self._end_time)
+            return
         # If the frame was processed in less time than frame_time then sleep for a bit
         while time.perf_counter() < self._end_time:
             time.sleep(0)
 
 
+class AsyncFrameManager(FrameManager):
+    """
+    The same as FrameManager but for use in asyncio code.
+    The wait at the end of the frame lets other tasks run rather than blocking the thread.
+
+    async with AsyncFrameManager(frame_time):
+        print("your frame code here")
+        await show_async(pixels)
+    """
+
+    async def __aenter__(self):
+        self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._frame_finished(exc_type)
+        sleeper = getattr(neopixel, "sleeper", None)
+        if sleeper is not None:
+            await sleeper.sleep_until_async(self._end_time)
+        else:
+            # asyncio is imported here because it is slow to import and only the async code needs it
+            import asyncio
+
+            await asyncio.sleep(max(self._end_time - time.perf_counter(), 0))
+
+
+async def show_async(pixels):
+    """
+    Show the pixels without blocking the event loop while waiting for the simulator's show delay.
+    The real library does not have show_async so show is called instead.
+    """
+    pixels_show_async = getattr(pixels, "show_async", None)
+    if pixels_show_async is None:
+        pixels.show()
+    else:
+        await pixels_show_async()
+
+
 if __name__ == "__main__":
     print("matts_tree_helpers.py is not directly callable. Import it from your code.")
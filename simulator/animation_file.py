@@ -0,0 +1,470 @@
+"""
+Readers and writers for the animation files produced by the simulator.
+
+The CSV format is the one used by run.py in the GSD6338/XmasTree repository.
+The first row contains the column names FRAME_TIME,R_0,G_0,B_0,R_1,...
+Each following row contains the frame time in milliseconds and the RGB value of each LED.
+
+The binary format stores the same data in a compact form that can be memory mapped. See BINARY_MAGIC.
+
+Run this module directly to convert between the formats.
+python animation_file.py animation.csv animation.xmas
+"""
+
+from typing import Sequence, Tuple, Iterator, BinaryIO, Optional
+import argparse
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy
+
+
+def csv_header(pixel_count: int) -> str:
+    """The header row of an animation CSV file."""
+    colour_header_names = ",".join(
+        f"{channel}_{led}" for led in range(pixel_count) for channel in "RGB"
+    )
+    return f"FRAME_TIME,{colour_header_names}\n"
+
+
+# The number of frames formatted at once when writing a CSV file
+CSV_BLOCK_SIZE = 256
+
+# The ASCII text of each uint8 value followed by a comma. Unused bytes are zero.
+_VALUE_TEXT = numpy.zeros((256, 4), dtype=numpy.uint8)
+for _value in range(256):
+    _text = f"{_value},".encode("ascii")
+    _VALUE_TEXT[_value, : len(_text)] = list(_text)
+
+
+def format_csv_rows(frame_times: Sequence[float], frames: Sequence[numpy.ndarray]) -> str:
+    """
+    Format frames as animation CSV rows.
+    The colour values for the whole block of frames are converted to text at once.
+
+    :param frame_times: The duration of each frame in seconds.
+    :param frames: The (n, 3) uint8 RGB colours for each frame.
+    """
+    if not len(frames):
+        return ""
+    values = numpy.stack(frames).reshape(len(frames), -1)
+    text = _VALUE_TEXT[values]
+    # replace the comma after the last value in each row with a new line
+    last_text = text[:, -1]
+    last_text[last_text == ord(",")] = ord("\n")
+    text = text.ravel()
+    colour_rows = text[text != 0].tobytes().decode("ascii").splitlines(keepends=True)
+    return "".join(
+        f"{round(frame_time*1000, 3)},{colour_row}"
+        for frame_time, colour_row in zip(frame_times, colour_rows)
+    )
+
+
+class AnimationWriter:
+    """
+    Write frames to an animation file as they are produced.
+
+    The frames are formatted and written on a background thread.
+    At most max_queued_frames can be waiting to be written. write blocks when the queue is full.
+    The file is flushed every flush_interval seconds so little is lost if the process is killed.
+    close must be called to write the remaining frames.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        pixel_count: int,
+        *,
+        max_queued_frames: int = 256,
+        flush_interval: float = 1.0,
+    ):
+        self._path = path
+        self._pixel_count = pixel_count
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue(max_queued_frames)
+        self._error = None
+        self._file = self._open()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        """Open the file and write the header."""
+        raise NotImplementedError
+
+    def _write_frames(
+        self,
+        frame_times: Sequence[float],
+        frames: Sequence[numpy.ndarray],
+        changed: Sequence[Optional[numpy.ndarray]],
+    ):
+        """
+        Write a block of frames to the file. Called on the writer thread.
+        changed has the indexes of the LEDs that differ from the previous frame, or None if they are not known.
+        """
+        raise NotImplementedError
+
+    def _finish(self):
+        """Write anything still buffered before the file is closed. Called on the writer thread."""
+        pass
+
+    def write(
+        self, frame_time: float, frame: numpy.ndarray, changed: Optional[numpy.ndarray] = None
+    ):
+        """
+        Queue a frame to be written.
+
+        :param frame_time: The duration of the frame in seconds.
+        :param frame: The (n, 3) uint8 RGB colours. This must not be modified after it is given.
+        :param changed: The indexes of the LEDs that differ from the previous frame written, if known.
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put((frame_time, frame, changed))
+
+    async def wait_async(self):
+        """Wait without blocking the event loop until write can queue a frame without blocking."""
+        if not self._queue.full():
+            return
+        # asyncio is imported here because it is slow to import and only the async code needs it
+        import asyncio
+
+        # The wait happens on another thread rather than polling with asyncio.sleep
+        # because the event loop timers do not advance on the virtual clock.
+        await asyncio.get_running_loop().run_in_executor(None, self._wait_not_full)
+
+    def _wait_not_full(self):
+        with self._queue.not_full:
+            # the timeout is on the real clock. It stops the wait if the writer thread dies.
+            while len(self._queue.queue) >= self._queue.maxsize and self._thread.is_alive():
+                self._queue.not_full.wait(0.1)
+
+    def close(self):
+        """Write all the queued frames and close the file."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        running = True
+        last_flush = time.perf_counter()
+        try:
+            while running:
+                # wait for a frame and then take everything else that is queued
+                try:
+                    items = [self._queue.get(timeout=self._flush_interval)]
+                except queue.Empty:
+                    items = []
+                while True:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if items and items[-1] is None:
+                    running = False
+                    items.pop()
+                if items:
+                    frame_times, frames, changed = zip(*items)
+                    self._write_frames(frame_times, frames, changed)
+                now = time.perf_counter()
+                if now - last_flush >= self._flush_interval:
+                    self._file.flush()
+                    last_flush = now
+            self._finish()
+        except Exception as e:
+            self._error = e
+            # drain the queue so that write and close do not block forever
+            while running and self._queue.get() is not None:
+                pass
+        finally:
+            self._file.close()
+
+
+class CSVAnimationWriter(AnimationWriter):
+    """Stream frames to an animation CSV file."""
+
+    def _open(self):
+        f = open(self._path, "w", buffering=1 << 20)
+        f.write(csv_header(self._pixel_count))
+        return f
+
+    def _write_frames(
+        self,
+        frame_times: Sequence[float],
+        frames: Sequence[numpy.ndarray],
+        changed: Sequence[Optional[numpy.ndarray]],
+    ):
+        self._file.write(format_csv_rows(frame_times, frames))
+
+
+# The binary animation format.
+# A 16 byte header followed by one record per frame.
+# In the raw encoding each record is the frame time in milliseconds as a little endian float32
+# followed by the n*3 RGB uint8 values.
+# All records are the same size so the frames can be memory mapped.
+# In the delta encoding each record starts with a uint8 record type and the float32 frame time.
+# A keyframe record is followed by the n*3 RGB uint8 values.
+# A delta record is followed by a uint32 count, count uint32 LED indexes and count*3 RGB uint8 values
+# containing only the LEDs that changed since the previous record.
+# Consecutive identical frames are merged into one record with the sum of the frame times.
+BINARY_MAGIC = b"XMASANIM"
+BINARY_VERSION = 1
+BINARY_ENCODING_RAW = 0
+BINARY_ENCODING_DELTA = 1
+_KEYFRAME_RECORD = 0
+_DELTA_RECORD = 1
+_RECORD_HEADER = struct.Struct("<Bf")  # record type, frame time
+_DELTA_COUNT = struct.Struct("<I")
+_BINARY_HEADER = struct.Struct("<8sHHI")  # magic, version, encoding, pixel count
+
+
+def binary_frame_dtype(pixel_count: int) -> numpy.dtype:
+    """The numpy dtype of a frame record in a binary animation file."""
+    return numpy.dtype([("frame_time", "<f4"), ("colours", "u1", (pixel_count, 3))])
+
+
+def _read_binary_header(f: BinaryIO) -> Tuple[int, int]:
+    """Read the header and return the encoding and the pixel count."""
+    magic, version, encoding, pixel_count = _BINARY_HEADER.unpack(
+        f.read(_BINARY_HEADER.size)
+    )
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"{f.name} is not a binary animation file.")
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary animation version {version}")
+    return encoding, pixel_count
+
+
+def load_binary_animation(path: str) -> numpy.memmap:
+    """
+    Memory map a binary animation file.
+    Returns a structured array with a frame_time field (milliseconds) and a colours field ((n, 3) uint8 RGB).
+    """
+    with open(path, "rb") as f:
+        encoding, pixel_count = _read_binary_header(f)
+    if encoding != BINARY_ENCODING_RAW:
+        raise ValueError(f"{path} is compressed and cannot be memory mapped.")
+    dtype = binary_frame_dtype(pixel_count)
+    frame_count = (os.path.getsize(path) - _BINARY_HEADER.size) // dtype.itemsize
+    return numpy.memmap(
+        path, dtype=dtype, mode="r", offset=_BINARY_HEADER.size, shape=(frame_count,)
+    )
+
+
+class BinaryAnimationWriter(AnimationWriter):
+    """Stream frames to a binary animation file."""
+
+    _encoding = BINARY_ENCODING_RAW
+
+    def _open(self):
+        f = open(self._path, "wb", buffering=1 << 20)
+        f.write(
+            _BINARY_HEADER.pack(
+                BINARY_MAGIC, BINARY_VERSION, self._encoding, self._pixel_count
+            )
+        )
+        return f
+
+    def _write_frames(
+        self,
+        frame_times: Sequence[float],
+        frames: Sequence[numpy.ndarray],
+        changed: Sequence[Optional[numpy.ndarray]],
+    ):
+        records = numpy.empty(len(frames), dtype=binary_frame_dtype(self._pixel_count))
+        records["frame_time"] = numpy.asarray(frame_times) * 1000
+        records["colours"] = frames
+        self._file.write(records.tobytes())
+
+
+class CompressedBinaryAnimationWriter(BinaryAnimationWriter):
+    """
+    Stream frames to a binary animation file using the delta encoding.
+    Only the LEDs that changed are stored with a full keyframe every keyframe_interval records.
+    """
+
+    _encoding = BINARY_ENCODING_DELTA
+
+    def __init__(self, path: str, pixel_count: int, *, keyframe_interval: int = 300, **kwargs):
+        self._keyframe_interval = keyframe_interval
+        # The number of records written since the last keyframe
+        self._records_since_keyframe = keyframe_interval
+        # The frame that has been written to the file
+        self._written_frame = numpy.zeros((pixel_count, 3), dtype=numpy.uint8)
+        # The frame waiting to be written. It is extended if the next frame is the same.
+        self._pending_frame: Optional[numpy.ndarray] = None
+        # The indexes of the LEDs in the pending frame that differ from the written frame, if known
+        self._pending_changed: Optional[numpy.ndarray] = None
+        self._pending_time = 0.0
+        super().__init__(path, pixel_count, **kwargs)
+
+    def _write_frames(
+        self,
+        frame_times: Sequence[float],
+        frames: Sequence[numpy.ndarray],
+        changed: Sequence[Optional[numpy.ndarray]],
+    ):
+        for frame_time, frame, frame_changed in zip(frame_times, frames, changed):
+            if self._pending_frame is not None and (
+                len(frame_changed) == 0
+                if frame_changed is not None
+                else numpy.array_equal(frame, self._pending_frame)
+            ):
+                self._pending_time += frame_time
+            else:
+                self._write_pending()
+                self._pending_frame = frame
+                self._pending_changed = frame_changed
+                self._pending_time = frame_time
+
+    def _finish(self):
+        self._write_pending()
+
+    def _write_pending(self):
+        if self._pending_frame is None:
+            return
+        frame = self._pending_frame
+        frame_time = self._pending_time * 1000
+        changed = self._pending_changed
+        if changed is None:
+            changed = numpy.flatnonzero(numpy.any(frame != self._written_frame, axis=1))
+        # a delta record costs 7 bytes per changed LED. Use a keyframe if that is larger.
+        if (
+            self._records_since_keyframe >= self._keyframe_interval
+            or len(changed) * 7 >= frame.size
+        ):
+            self._file.write(_RECORD_HEADER.pack(_KEYFRAME_RECORD, frame_time))
+            self._file.write(frame.tobytes())
+            self._records_since_keyframe = 0
+        else:
+            self._file.write(_RECORD_HEADER.pack(_DELTA_RECORD, frame_time))
+            self._file.write(_DELTA_COUNT.pack(len(changed)))
+            self._file.write(changed.astype("<u4").tobytes())
+            self._file.write(frame[changed].tobytes())
+            self._records_since_keyframe += 1
+        self._written_frame = frame
+        self._pending_frame = None
+
+
+def _iter_delta_records(f: BinaryIO, pixel_count: int) -> Iterator[Tuple[float, numpy.ndarray]]:
+    """Decode the records of a delta encoded binary animation file."""
+    frame = numpy.zeros((pixel_count, 3), dtype=numpy.uint8)
+    while True:
+        record_header = f.read(_RECORD_HEADER.size)
+        if len(record_header) < _RECORD_HEADER.size:
+            break
+        record_type, frame_time = _RECORD_HEADER.unpack(record_header)
+        frame = frame.copy()
+        if record_type == _KEYFRAME_RECORD:
+            frame[:] = numpy.frombuffer(f.read(frame.size), dtype=numpy.uint8).reshape(
+                pixel_count, 3
+            )
+        elif record_type == _DELTA_RECORD:
+            (count,) = _DELTA_COUNT.unpack(f.read(_DELTA_COUNT.size))
+            indexes = numpy.frombuffer(f.read(count * 4), dtype="<u4")
+            frame[indexes] = numpy.frombuffer(f.read(count * 3), dtype=numpy.uint8).reshape(
+                count, 3
+            )
+        else:
+            raise ValueError(f"Unknown record type {record_type}")
+        yield frame_time, frame
+
+
+def iter_csv_animation(path: str) -> Iterator[Tuple[float, numpy.ndarray]]:
+    """
+    Lazily read an animation CSV file one row at a time.
+    Yields the frame time in milliseconds and the (n, 3) uint8 RGB colours of each frame.
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        header = f.readline().rstrip("\n").split(",")
+        if not header or header[0] != "FRAME_TIME" or (len(header) - 1) % 3:
+            raise ValueError(f"{path} is not an animation CSV file.")
+        pixel_count = (len(header) - 1) // 3
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            frame_time, colours = line.split(",", 1)
+            yield float(frame_time), numpy.fromiter(
+                map(int, colours.split(",")), dtype=numpy.uint8, count=pixel_count * 3
+            ).reshape(pixel_count, 3)
+
+
+def iter_binary_animation(path: str) -> Iterator[Tuple[float, numpy.ndarray]]:
+    """
+    Read a binary animation file one frame at a time.
+    Yields the frame time in milliseconds and the (n, 3) uint8 RGB colours of each frame.
+    """
+    with open(path, "rb") as f:
+        encoding, pixel_count = _read_binary_header(f)
+        if encoding == BINARY_ENCODING_DELTA:
+            yield from _iter_delta_records(f, pixel_count)
+            return
+    for record in load_binary_animation(path):
+        yield float(record["frame_time"]), numpy.array(record["colours"])
+
+
+def iter_animation(path: str) -> Iterator[Tuple[float, numpy.ndarray]]:
+    """Read an animation file of any supported format based on the file extension."""
+    if path.endswith(".csv"):
+        return iter_csv_animation(path)
+    else:
+        return iter_binary_animation(path)
+
+
+def get_animation_pixel_count(path: str) -> int:
+    """Get the number of LEDs in an animation file without reading the frames."""
+    if path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig") as f:
+            return (len(f.readline().split(",")) - 1) // 3
+    else:
+        with open(path, "rb") as f:
+            return _read_binary_header(f)[1]
+
+
+def open_animation_writer(path: str, pixel_count: int, compress: bool = False) -> AnimationWriter:
+    """
+    Create the writer for the format of path. Files ending .csv are CSV files. Anything else is binary.
+    If compress is true the binary file is written with the delta encoding.
+    """
+    if path.endswith(".csv"):
+        return CSVAnimationWriter(path, pixel_count)
+    elif compress:
+        return CompressedBinaryAnimationWriter(path, pixel_count)
+    else:
+        return BinaryAnimationWriter(path, pixel_count)
+
+
+def convert_animation(src_path: str, dst_path: str, compress: bool = False):
+    """
+    Convert an animation file between the CSV and binary formats.
+    The format of each file is chosen by the file extension. Files ending .csv are CSV files. Anything else is binary.
+    If compress is true the binary file is written with the delta encoding.
+    """
+    writer = open_animation_writer(dst_path, get_animation_pixel_count(src_path), compress)
+    try:
+        for frame_time, frame in iter_animation(src_path):
+            # The writers take the frame time in seconds
+            writer.write(frame_time / 1000, frame)
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert an animation file between the CSV and binary formats. "
+        "Files ending .csv are CSV files. Anything else is binary."
+    )
+    parser.add_argument("src_path", type=str, help="The animation file to read.")
+    parser.add_argument("dst_path", type=str, help="The animation file to write.")
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Write the binary file with the delta encoding.",
+    )
+    args = parser.parse_args()
+    convert_animation(args.src_path, args.dst_path, args.compress)
@@ -0,0 +1,394 @@
+"""
+Bake the animation files of many scripts in parallel.
+
+python bake.py ../examples/*/ggjgc_*.py --coordinates-path coords_2021.csv --seconds 60 --output-dir baked
+
+Each script is run headless on the virtual clock so a job runs as fast as the computer can compute the frames.
+Jobs are run in parallel, one process per job, using all the CPU cores by default.
+
+A parameter sweep can be described in a JSON file with --jobs-file.
+Each entry has a script and optionally a list of parameter sets.
+Each parameter set is a list of extra command line arguments passed to the script.
+
+[
+    {"script": "../examples/ggjgc_snow/ggjgc_snow.py"},
+    {"script": "my_animation.py", "params": [["10"], ["20"]], "seconds": 30}
+]
+
+Animations written as a shader (see run_shader in matts_tree_helpers) only depend on the coordinates and the time
+so their frames can be computed in any order. --shader splits the frames of one animation into blocks
+which are computed in parallel and written to the file in order.
+
+python bake.py --shader ../examples/ggjgc_rainbow_spiral/ggjgc_rainbow_spiral.py:rainbow_spiral_shader \
+    --coordinates-path coords_2021.csv --seconds 600
+"""
+
+from typing import List, Optional
+import argparse
+import collections
+import concurrent.futures
+import importlib.util
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from headless import run_headless, REPOSITORY_DIR
+from animation_file import open_animation_writer
+
+
+class BakeJob:
+    """One script to run with one set of extra command line arguments."""
+
+    def __init__(
+        self,
+        script: str,
+        args: List[str],
+        seconds: float,
+        output_path: str,
+    ):
+        self.script = script
+        self.args = args
+        self.seconds = seconds
+        self.output_path = output_path
+        self.name = os.path.splitext(os.path.basename(output_path))[0]
+
+
+def _job_name(script: str, args: List[str]) -> str:
+    """The file name of the output of a job without the extension."""
+    name = os.path.splitext(os.path.basename(script))[0]
+    if args:
+        name += "_" + "_".join(args)
+    return re.sub(r"[^\w.-]+", "-", name)
+
+
+def make_jobs(
+    script: str,
+    params: Optional[List[List[str]]],
+    seconds: float,
+    output_dir: str,
+    extension: str = ".csv",
+) -> List[BakeJob]:
+    """Create a job for each parameter set of a script. If params is None the script is run once without arguments."""
+    return [
+        BakeJob(
+            script,
+            [str(arg) for arg in args],
+            seconds,
+            os.path.join(output_dir, _job_name(script, args) + extension),
+        )
+        for args in params or [[]]
+    ]
+
+
+def unique_output_paths(paths: List[str]) -> List[str]:
+    """
+    Add a numbered suffix to the paths that are the same as an earlier path, eg scripts with the same name
+    in different directories, so that the outputs do not overwrite each other.
+    """
+    used = set()
+    unique_paths = []
+    for path in paths:
+        root, extension = os.path.splitext(path)
+        unique_path = path
+        number = 2
+        while os.path.abspath(unique_path) in used:
+            unique_path = f"{root}_{number}{extension}"
+            number += 1
+        used.add(os.path.abspath(unique_path))
+        unique_paths.append(unique_path)
+    return unique_paths
+
+
+def load_jobs_file(
+    path: str, default_seconds: float, output_dir: str, extension: str = ".csv"
+) -> List[BakeJob]:
+    """Load the jobs described in a JSON file. See the module docstring for the format."""
+    with open(path) as f:
+        entries = json.load(f)
+    jobs = []
+    for entry in entries:
+        jobs += make_jobs(
+            entry["script"],
+            entry.get("params"),
+            entry.get("seconds", default_seconds),
+            output_dir,
+            extension,
+        )
+    return jobs
+
+
+def run_job(job: BakeJob, coords_path: str, timeout: Optional[float]) -> dict:
+    """Run one job in its own temporary directory and return the result."""
+    result = {"name": job.name, "output": job.output_path}
+    if job.output_path.endswith(".csv"):
+        save_args = ["--animation-csv-save-path", os.path.abspath(job.output_path)]
+    else:
+        save_args = ["--animation-bin-save-path", os.path.abspath(job.output_path)]
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as work_dir:
+        # the scripts load coords_2021.csv from the working directory
+        shutil.copy(coords_path, os.path.join(work_dir, "coords_2021.csv"))
+        try:
+            process = run_headless(
+                job.script,
+                ["--simulate-seconds", str(job.seconds), *save_args, *job.args],
+                work_dir,
+                timeout,
+            )
+        except subprocess.TimeoutExpired:
+            result["status"] = "timeout"
+            result["time"] = round(time.perf_counter() - start, 3)
+            return result
+    result["time"] = round(time.perf_counter() - start, 3)
+    if process.returncode or not os.path.isfile(job.output_path):
+        result["status"] = "error"
+        result["error"] = process.stderr.strip().splitlines()[-1:]
+    else:
+        result["status"] = "ok"
+    return result
+
+
+def bake(
+    jobs: List[BakeJob],
+    coords_path: str,
+    processes: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> List[dict]:
+    """
+    Run the jobs in parallel and print the progress.
+
+    :param jobs: The jobs to run.
+    :param coords_path: The coordinates file to run the scripts with.
+    :param processes: The number of jobs to run at once. Defaults to the number of CPU cores.
+    :param timeout: The maximum number of seconds each job can take.
+    :return: The result of each job in the same order as jobs.
+    """
+    output_paths = [os.path.abspath(job.output_path) for job in jobs]
+    if len(set(output_paths)) != len(output_paths):
+        raise ValueError(
+            "More than one job writes to the same output path. See unique_output_paths."
+        )
+    for job in jobs:
+        os.makedirs(os.path.dirname(os.path.abspath(job.output_path)), exist_ok=True)
+    processes = processes or os.cpu_count() or 1
+    results = [None] * len(jobs)
+    start = time.perf_counter()
+    # each job is its own process. The threads only wait for them to finish.
+    with concurrent.futures.ThreadPoolExecutor(processes) as executor:
+        futures = {
+            executor.submit(run_job, job, coords_path, timeout): i
+            for i, job in enumerate(jobs)
+        }
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            result = future.result()
+            results[futures[future]] = result
+            message = f"[{done}/{len(jobs)}] {result['name']:<40} {result['status']:<8} {result['time']:>8.1f}s"
+            if result.get("error"):
+                message += f" {result['error'][0]}"
+            print(message, flush=True)
+
+    counts = {
+        status: sum(result["status"] == status for result in results)
+        for status in ("ok", "error", "timeout")
+    }
+    print(
+        f"Baked {counts['ok']} of {len(jobs)} animations in {time.perf_counter() - start:.1f}s. "
+        f"{counts['error']} failed. {counts['timeout']} timed out."
+    )
+    return results
+
+
+def load_shader(shader_path: str):
+    """Load a shader function from a string in the form path/to/script.py:function_name."""
+    script_path, function_name = shader_path.rsplit(":", 1)
+    script_path = os.path.abspath(script_path)
+    # the scripts import matts_tree_helpers from the repository root and may import modules next to them
+    for path in (REPOSITORY_DIR, os.path.dirname(script_path)):
+        if path not in sys.path:
+            sys.path.append(path)
+    module_name = os.path.splitext(os.path.basename(script_path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, function_name)
+
+
+# The shader and tree geometry of each worker process. Set by _init_shader_worker.
+_worker_shader = None
+_worker_tree = None
+
+
+def _init_shader_worker(shader_path: str, coords):
+    global _worker_shader, _worker_tree
+    _worker_shader = load_shader(shader_path)
+    from matts_tree_helpers import TreeGeometry
+
+    _worker_tree = TreeGeometry(coords)
+
+
+def _render_shader_block(times):
+    from matts_tree_helpers import render_frames
+
+    frames = render_frames(_worker_shader, _worker_tree, times)
+    # the shaders return GRB colours like the tree. The animation files are RGB.
+    return frames[:, :, [1, 0, 2]]
+
+
+def bake_shader(
+    shader_path: str,
+    coords_path: str,
+    output_path: str,
+    seconds: float,
+    frame_time: float = 1 / 30,
+    processes: Optional[int] = None,
+    block_size: int = 64,
+    compress: bool = False,
+):
+    """
+    Compute the frames of a shader animation in parallel and write them to an animation file in order.
+
+    :param shader_path: The shader function in the form path/to/script.py:function_name.
+    :param coords_path: The coordinates file to compute the frames for.
+    :param output_path: The animation file to write. Files ending .csv are CSV files. Anything else is binary.
+    :param seconds: The length of the animation. The first frame is at time 0.
+    :param frame_time: The duration of each frame in seconds.
+    :param processes: The number of worker processes. Defaults to the number of CPU cores.
+    :param block_size: The number of frames each worker computes at a time.
+    :param compress: If true binary files are written with the delta encoding.
+    """
+    if REPOSITORY_DIR not in sys.path:
+        sys.path.append(REPOSITORY_DIR)
+    from matts_tree_helpers import load_coords
+
+    coords = load_coords(coords_path)
+    frame_count = round(seconds / frame_time)
+    processes = processes or os.cpu_count() or 1
+    start = time.perf_counter()
+    writer = open_animation_writer(output_path, len(coords), compress)
+    try:
+        with multiprocessing.Pool(
+            processes, _init_shader_worker, (shader_path, coords)
+        ) as pool:
+            # Only a few blocks are in flight at once so that finished frames do not pile up in memory
+            pending = collections.deque()
+            for block_start in range(0, frame_count, block_size):
+                block_end = min(block_start + block_size, frame_count)
+                times = [i * frame_time for i in range(block_start, block_end)]
+                pending.append(pool.apply_async(_render_shader_block, (times,)))
+                if len(pending) > 2 * processes:
+                    for frame in pending.popleft().get():
+                        writer.write(frame_time, frame)
+            while pending:
+                for frame in pending.popleft().get():
+                    writer.write(frame_time, frame)
+    finally:
+        writer.close()
+    print(
+        f"Baked {frame_count} frames of {shader_path} to {output_path} "
+        f"in {time.perf_counter() - start:.1f}s."
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bake the animation files of many scripts in parallel."
+    )
+    parser.add_argument(
+        "scripts", type=str, nargs="*", help="The animation scripts to bake."
+    )
+    parser.add_argument(
+        "--shader",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Shader functions to bake in parallel blocks of frames. eg path/to/script.py:function_name",
+    )
+    parser.add_argument(
+        "--fps",
+        type=float,
+        default=30,
+        help="The frame rate of the baked shaders.",
+    )
+    parser.add_argument(
+        "--jobs-file",
+        type=str,
+        help="A JSON file of scripts and parameter sets to bake as well as the scripts.",
+    )
+    parser.add_argument(
+        "--coordinates-path",
+        type=str,
+        required=True,
+        help="The coordinates to run the scripts with.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="baked",
+        help="The directory to save the animation files in.",
+    )
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=60,
+        help="The number of seconds of animation to bake for each job.",
+    )
+    parser.add_argument(
+        "--binary",
+        action="store_true",
+        help="If true the animations are saved in the binary format rather than CSV.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="The number of jobs to run at once. Defaults to the number of CPU cores.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="The maximum number of seconds each job can take.",
+    )
+    args = parser.parse_args()
+    extension = ".bin" if args.binary else ".csv"
+    jobs = []
+    for script in args.scripts:
+        jobs += make_jobs(script, None, args.seconds, args.output_dir, extension)
+    if args.jobs_file is not None:
+        jobs += load_jobs_file(args.jobs_file, args.seconds, args.output_dir, extension)
+    if not jobs and not args.shader:
+        parser.error("No scripts given.")
+    shader_output_paths = [
+        os.path.join(args.output_dir, shader_path.rsplit(":", 1)[1] + extension)
+        for shader_path in args.shader
+    ]
+    output_paths = unique_output_paths(
+        shader_output_paths + [job.output_path for job in jobs]
+    )
+    shader_output_paths = output_paths[: len(shader_output_paths)]
+    jobs = [
+        BakeJob(job.script, job.args, job.seconds, output_path)
+        for job, output_path in zip(jobs, output_paths[len(shader_output_paths) :])
+    ]
+    for shader_path, output_path in zip(args.shader, shader_output_paths):
+        os.makedirs(args.output_dir, exist_ok=True)
+        bake_shader(
+            shader_path,
+            args.coordinates_path,
+            output_path,
+            args.seconds,
+            1 / args.fps,
+            args.processes,
+        )
+    if jobs:
+        results = bake(jobs, args.coordinates_path, args.processes, args.timeout)
+        if any(result["status"] != "ok" for result in results):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
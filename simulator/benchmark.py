@@ -0,0 +1,253 @@
+"""
+Benchmark the simulator by running the example animations headless for a fixed number of frames.
+
+python benchmark.py --coordinates-path coords_2021.csv --output results.json
+
+Each example is run on the real tree coordinates and on synthetic trees of different sizes.
+A minimal animation that only sets and shows the pixels is also run to measure the NeoPixel and FrameManager stack.
+The time taken to import neopixel in a new process is measured as well.
+The frames per second, per frame latency percentiles and peak memory of each run are saved as JSON
+so that different revisions can be compared.
+"""
+
+from typing import List, Optional
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+from headless import run_headless, simulator_environment, REPOSITORY_DIR
+
+# A minimal animation used to measure the overhead of the NeoPixel and FrameManager stack
+STACK_SCRIPT = """
+import numpy
+from matts_tree_helpers import get_coords_pixels, FrameManager
+
+coords, pixels = get_coords_pixels("coords_2021.csv")
+colours = numpy.zeros((len(coords), 3))
+frame = 0
+while True:
+    with FrameManager(1 / 30):
+        colours[:] = frame % 256
+        pixels.set_all(colours)
+        pixels.show()
+        frame += 1
+"""
+
+# Prints the time taken to import neopixel and if that imported matplotlib
+IMPORT_SCRIPT = """
+import sys
+import time
+
+start = time.perf_counter()
+import neopixel
+
+print(time.perf_counter() - start, "matplotlib" in sys.modules)
+"""
+
+
+def benchmark_import(repeats: int = 5) -> dict:
+    """Import neopixel in a new process repeats times and return the import times in milliseconds."""
+    import_times = []
+    matplotlib_imported = False
+    for _ in range(repeats):
+        process = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            env=simulator_environment(),
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        import_time, imported = process.stdout.split()
+        import_times.append(float(import_time) * 1000)
+        matplotlib_imported |= imported == "True"
+    return {
+        "repeats": repeats,
+        "min": round(min(import_times), 3),
+        "median": round(float(numpy.median(import_times)), 3),
+        "matplotlib_imported": matplotlib_imported,
+    }
+
+
+def write_synthetic_coords(path: str, pixel_count: int, seed: int = 0):
+    """Write a CSV coordinate file of pixel_count LEDs randomly placed in a cone shaped tree."""
+    rng = numpy.random.default_rng(seed)
+    height = rng.uniform(0, 1, pixel_count) ** 0.5
+    radius = (1 - height) * 0.4 * numpy.sqrt(rng.uniform(0, 1, pixel_count))
+    angle = rng.uniform(0, 2 * numpy.pi, pixel_count)
+    coords = numpy.stack(
+        [radius * numpy.cos(angle), radius * numpy.sin(angle), height * 1.6], axis=1
+    )
+    numpy.savetxt(path, coords, delimiter=",", fmt="%.6f")
+
+
+def run_benchmark(
+    name: str,
+    script_path: str,
+    coords_path: str,
+    frames: int,
+    timeout: float,
+) -> dict:
+    """Run one script headless for a number of frames and return its results."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        shutil.copy(coords_path, os.path.join(work_dir, "coords_2021.csv"))
+        with open(coords_path) as f:
+            pixel_count = sum(1 for line in f if line.strip())
+        report_path = os.path.join(work_dir, "report.json")
+        result = {"name": name, "leds": pixel_count, "frames": frames}
+        start = time.perf_counter()
+        try:
+            process = run_headless(
+                script_path,
+                ["--simulate-frames", str(frames), "--perf-report", report_path],
+                work_dir,
+                timeout,
+            )
+        except subprocess.TimeoutExpired:
+            result["status"] = "timeout"
+            return result
+        result["wall_time"] = round(time.perf_counter() - start, 3)
+        if process.returncode or not os.path.isfile(report_path):
+            result["status"] = "error"
+            result["error"] = process.stderr.strip().splitlines()[-1:]
+            return result
+        with open(report_path) as f:
+            report = json.load(f)
+    result["status"] = "ok"
+    result["fps"] = report["shows_per_second"]
+    result["compute_time"] = report["compute_time"]
+    result["show_time"] = report["show_time"]
+    result["peak_memory_mb"] = report["peak_memory_mb"]
+    return result
+
+
+def find_examples(examples_dir: str) -> List[str]:
+    """Find the example animation scripts."""
+    return sorted(glob.glob(os.path.join(examples_dir, "ggjgc_*", "ggjgc_*.py")))
+
+
+def run_benchmarks(
+    coords_path: Optional[str],
+    synthetic_sizes: List[int],
+    frames: int,
+    timeout: float,
+    examples_dir: str,
+    names: Optional[List[str]] = None,
+) -> dict:
+    """Run every benchmark and return the results."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        stack_script = os.path.join(work_dir, "stack.py")
+        with open(stack_script, "w") as f:
+            f.write(STACK_SCRIPT)
+        scripts = [("stack", stack_script)] + [
+            (os.path.splitext(os.path.basename(path))[0], path)
+            for path in find_examples(examples_dir)
+        ]
+        if names:
+            scripts = [(name, path) for name, path in scripts if name in names]
+
+        trees = []
+        if coords_path is not None:
+            trees.append(coords_path)
+        for size in synthetic_sizes:
+            path = os.path.join(work_dir, f"synthetic_{size}.csv")
+            write_synthetic_coords(path, size)
+            trees.append(path)
+
+        import_result = None
+        if not names or "import" in names:
+            import_result = benchmark_import()
+            print(
+                f"{'import neopixel':<28} median {import_result['median']:.1f}ms "
+                f"min {import_result['min']:.1f}ms "
+                f"matplotlib imported: {import_result['matplotlib_imported']}"
+            )
+
+        results = []
+        for tree_path in trees:
+            for name, script_path in scripts:
+                result = run_benchmark(name, script_path, tree_path, frames, timeout)
+                results.append(result)
+                if result["status"] == "ok":
+                    print(
+                        f"{name:<28} {result['leds']:>7} LEDs {result['fps']:>10.1f} fps "
+                        f"p50 {result['compute_time']['p50']:>9.3f}ms "
+                        f"p99 {result['compute_time']['p99']:>9.3f}ms "
+                        f"{result['peak_memory_mb']}MB"
+                    )
+                else:
+                    print(f"{name:<28} {result['leds']:>7} LEDs {result['status']}")
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "frames": frames,
+        "import": import_result,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the simulator with the example animations."
+    )
+    parser.add_argument(
+        "--coordinates-path",
+        type=str,
+        help="The coordinates of the real tree. If not given only the synthetic trees are used.",
+    )
+    parser.add_argument(
+        "--synthetic-sizes",
+        type=int,
+        nargs="*",
+        default=[1_000, 10_000, 100_000],
+        help="The number of LEDs in each synthetic tree.",
+    )
+    parser.add_argument(
+        "--frames", type=int, default=100, help="The number of frames to run each animation for."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=300,
+        help="The maximum number of seconds each run can take.",
+    )
+    parser.add_argument(
+        "--examples-dir",
+        type=str,
+        default=os.path.join(REPOSITORY_DIR, "examples"),
+        help="The directory containing the example animations.",
+    )
+    parser.add_argument(
+        "--only",
+        type=str,
+        nargs="*",
+        help="Only run the benchmarks with these names. eg import stack ggjgc_snow",
+    )
+    parser.add_argument(
+        "--output", type=str, help="The path to save the JSON results to."
+    )
+    args = parser.parse_args()
+    results = run_benchmarks(
+        args.coordinates_path,
+        args.synthetic_sizes,
+        args.frames,
+        args.timeout,
+        args.examples_dir,
+        args.only,
+    )
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Records where the frame time goes so that you can tell if an animation will keep up on the real tree.
+
+Enable it with the --perf-report [path] CLI option.
+"""
+
+from typing import List, Dict, Optional
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+import numpy
+
+# The real clock. The virtual clock replaces time.perf_counter but the profiler should always measure real time.
+_perf_counter = time.perf_counter
+
+# The bin edges of the compute time histogram in milliseconds
+HISTOGRAM_EDGES = [0, 1, 2, 4, 8, 16, 32, 64, 128, 256, float("inf")]
+
+
+def _percentiles(values_ms: List[float]) -> Dict[str, float]:
+    """The percentiles of a list of durations in milliseconds."""
+    if not values_ms:
+        return {}
+    p50, p90, p99 = numpy.percentile(values_ms, [50, 90, 99]).tolist()
+    return {
+        "mean": round(float(numpy.mean(values_ms)), 3),
+        "p50": round(p50, 3),
+        "p90": round(p90, 3),
+        "p99": round(p99, 3),
+        "max": round(max(values_ms), 3),
+    }
+
+
+class FrameProfiler:
+    """
+    Records the time taken by each frame.
+
+    FrameManager calls frame_started and frame_finished around the user's code.
+    NeoPixel.show calls show_started and show_finished around giving the frame to the GUI and writers.
+    All times are measured on the real clock, even when the simulator is running on a virtual clock.
+    In that case the slack is the time that would have been slept in real time.
+    """
+
+    def __init__(self):
+        # The target duration of each frame in milliseconds
+        self._frame_budgets: List[float] = []
+        # The time spent in the user's code each frame in milliseconds
+        self._compute_times: List[float] = []
+        # The time left over at the end of each frame in milliseconds. Negative if the deadline was missed.
+        self._slack_times: List[float] = []
+        # The time taken by each show call excluding the show delay in milliseconds
+        self._show_times: List[float] = []
+        # The number of __setitem__, fill and set_all calls before each show call
+        self._setitem_counts: List[int] = []
+        self._frame_start: Optional[float] = None
+        self._frame_budget = 0.0
+        self._show_start = 0.0
+        # The real time the first and last show call finished
+        self._first_show_end: Optional[float] = None
+        self._last_show_end: Optional[float] = None
+
+    def frame_started(self, frame_time: float):
+        """Called at the start of a frame with the target frame time in seconds."""
+        self._frame_start = _perf_counter()
+        self._frame_budget = frame_time
+
+    def frame_finished(self):
+        """Called at the end of a frame before waiting for the deadline."""
+        if self._frame_start is None:
+            return
+        compute_time = _perf_counter() - self._frame_start
+        self._frame_budgets.append(self._frame_budget * 1000)
+        self._compute_times.append(compute_time * 1000)
+        self._slack_times.append((self._frame_budget - compute_time) * 1000)
+        self._frame_start = None
+
+    def show_started(self):
+        """Called at the start of NeoPixel.show."""
+        self._show_start = _perf_counter()
+
+    def show_finished(self, setitem_count: int):
+        """Called before NeoPixel.show waits for the show delay with the number of pixel writes since the last show."""
+        now = _perf_counter()
+        self._show_times.append((now - self._show_start) * 1000)
+        self._setitem_counts.append(setitem_count)
+        if self._first_show_end is None:
+            self._first_show_end = now
+        self._last_show_end = now
+
+    def report(self) -> dict:
+        """The summary of the recorded frames. All times are in milliseconds."""
+        slack = numpy.asarray(self._slack_times)
+        counts, _ = numpy.histogram(self._compute_times, HISTOGRAM_EDGES)
+        if len(self._show_times) > 1 and self._last_show_end > self._first_show_end:
+            # The number of frames shown per second of real time
+            show_rate = (len(self._show_times) - 1) / (
+                self._last_show_end - self._first_show_end
+            )
+        else:
+            show_rate = None
+        if resource is None:
+            peak_memory = None
+        else:
+            peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is in bytes on macOS and kilobytes on Linux
+            peak_memory /= 1024 * 1024 if sys.platform == "darwin" else 1024
+        return {
+            "frames": len(self._compute_times),
+            "shows": len(self._show_times),
+            "shows_per_second": show_rate and round(show_rate, 3),
+            "peak_memory_mb": peak_memory and round(peak_memory, 3),
+            "frame_budget": _percentiles(self._frame_budgets),
+            "compute_time": _percentiles(self._compute_times),
+            "slack_slept": _percentiles(numpy.maximum(slack, 0).tolist()),
+            "missed_deadlines": int(numpy.count_nonzero(slack < 0)),
+            "show_time": _percentiles(self._show_times),
+            "setitem_calls": {
+                "total": int(sum(self._setitem_counts)),
+                "per_show": _percentiles(self._setitem_counts),
+            },
+            "compute_time_histogram": {
+                "edges": [str(edge) for edge in HISTOGRAM_EDGES],
+                "counts": counts.tolist(),
+            },
+        }
+
+    def format_report(self) -> str:
+        """The summary of the recorded frames as human readable text."""
+        report = self.report()
+        lines = [
+            f"Frames: {report['frames']}  Shows: {report['shows']}  "
+            f"Missed deadlines: {report['missed_deadlines']}",
+            f"Shows per second: {report['shows_per_second']}  "
+            f"Peak memory: {report['peak_memory_mb']}MB",
+        ]
+        for key in ("frame_budget", "compute_time", "slack_slept", "show_time"):
+            stats = report[key]
+            if stats:
+                lines.append(
+                    f"{key:<14}"
+                    + "  ".join(f"{name} {value:8.3f}ms" for name, value in stats.items())
+                )
+        setitem_calls = report["setitem_calls"]
+        lines.append(f"setitem calls: {setitem_calls['total']}")
+        lines.append("Compute time histogram:")
+        counts = report["compute_time_histogram"]["counts"]
+        most = max(counts, default=0) or 1
+        for low, high, count in zip(HISTOGRAM_EDGES, HISTOGRAM_EDGES[1:], counts):
+            lines.append(f"  {low:>4}-{high:<4}ms {count:>7} {'#' * round(40 * count / most)}")
+        return "\n".join(lines)
+
+    def write_report(self, path: str):
+        """Write the report to path. Paths ending .json get the JSON report. - prints the text report."""
+        if path == "-":
+            print(self.format_report())
+        elif path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump(self.report(), f, indent=4)
+        else:
+            with open(path, "w") as f:
+                f.write(self.format_report() + "\n")
@@ -0,0 +1,58 @@
+"""
+Helpers to run animation scripts headless in a subprocess using this simulator.
+"""
+
+from typing import List, Optional, Dict
+import os
+import subprocess
+import sys
+
+# The directory containing the simulator modules
+SIMULATOR_DIR = os.path.dirname(os.path.abspath(__file__))
+# The root of the repository which contains matts_tree_helpers.py
+REPOSITORY_DIR = os.path.dirname(SIMULATOR_DIR)
+
+
+def simulator_environment() -> Dict[str, str]:
+    """
+    The environment variables to run a script with this simulator.
+    The simulator and the repository root are put at the front of the python path
+    so that the simulated neopixel and matts_tree_helpers are imported.
+    """
+    env = os.environ.copy()
+    python_path = [SIMULATOR_DIR, REPOSITORY_DIR]
+    if env.get("PYTHONPATH"):
+        python_path.append(env["PYTHONPATH"])
+    env["PYTHONPATH"] = os.pathsep.join(python_path)
+    return env
+
+
+def run_headless(
+    script_path: str,
+    simulator_args: List[str],
+    cwd: str,
+    timeout: Optional[float] = None,
+) -> subprocess.CompletedProcess:
+    """
+    Run a script without the GUI on the virtual clock.
+
+    :param script_path: The python script to run.
+    :param simulator_args: Extra command line arguments for the script and simulator.
+    :param cwd: The directory to run the script in. The examples load coords_2021.csv from here.
+    :param timeout: Kill the script if it takes longer than this many seconds. Raises subprocess.TimeoutExpired.
+    """
+    return subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(script_path),
+            "--no-gui",
+            "--virtual-time",
+            *simulator_args,
+        ],
+        cwd=cwd,
+        env=simulator_environment(),
+        timeout=timeout,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
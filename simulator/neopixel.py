@@ -8,16 +8,25 @@ import atexit
 import time
 
 from multiprocessing import Process, Queue
+from multiprocessing.shared_memory import SharedMemory
 import queue
 
-import matplotlib
-import matplotlib.pyplot as plt
+import numpy
 
+from animation_file import (
+    csv_header,
+    format_csv_rows,
+    AnimationWriter,
+    CSVAnimationWriter,
+    BinaryAnimationWriter,
+    CompressedBinaryAnimationWriter,
+    CSV_BLOCK_SIZE,
+)
+from frame_profiler import FrameProfiler
+from offscreen import OffscreenRenderWriter
+from power import PowerModel, PowerMonitor, MILLIAMPS_PER_CHANNEL
 
-# without this PyCharm displays it as an image that does not update.
-matplotlib.use("TkAgg")
-# set the style
-plt.style.use("dark_background")
+# matplotlib is only imported in the GUI process so that running with --no-gui is fast and does not need Tk.
 
 
 def get_parser():
@@ -36,6 +45,12 @@ def get_parser():
         type=float,
         help="Exit after this number of seconds if defined.",
     )
+    parser.add_argument(
+        "--simulate-frames",
+        dest="simulate_frames",
+        type=int,
+        help="Exit after this number of frames have been shown and recorded if defined.",
+    )
     parser.add_argument(
         "--animation-csv-save-path",
         dest="animation_csv_save_path",
@@ -43,6 +58,35 @@ def get_parser():
         help="If defined, will write the values set to an animation CSV file that can be loaded on Matt's tree."
         "Save happens at the end when either sys.exit is called by the code or the UI is closed.",
     )
+    parser.add_argument(
+        "--animation-bin-save-path",
+        dest="animation_bin_save_path",
+        type=str,
+        help="If defined, will write the values set to a binary animation file. "
+        "This is much smaller and faster to load than the CSV file. "
+        "animation_file.py can convert it to and from the CSV format.",
+    )
+    parser.add_argument(
+        "--compress-animation",
+        dest="compress_animation",
+        action="store_true",
+        help="If true the binary animation file only stores the LEDs that change each frame "
+        "and merges identical frames into one longer frame.",
+    )
+    parser.add_argument(
+        "--merge-identical-frames",
+        dest="merge_identical_frames",
+        action="store_true",
+        help="If true frames that are the same as the previous frame are recorded by extending "
+        "the duration of the previous frame rather than as a new frame.",
+    )
+    parser.add_argument(
+        "--stream-animation",
+        dest="stream_animation",
+        action="store_true",
+        help="If true the animation CSV file is written while the program runs rather than at exit. "
+        "This keeps memory use low for long animations.",
+    )
     parser.add_argument(
         "--show-delay",
         dest="show_delay",
@@ -51,6 +95,99 @@ def get_parser():
         "This emulates the behaviour of the real tree. Defaults to 1/60th of a second.",
         default=0,
     )
+    parser.add_argument(
+        "--hardware-timing",
+        dest="hardware_timing",
+        action="store_true",
+        help="If true the show delay is the time the real WS2811 LEDs take to receive a frame "
+        "rather than --show-delay. This depends on the number of pixels, the pixel order and --strip-segments.",
+    )
+    parser.add_argument(
+        "--strip-segments",
+        dest="strip_segments",
+        type=int,
+        default=1,
+        help="The number of data lines the LEDs are split between. They are sent in parallel. Defaults to 1.",
+    )
+    parser.add_argument(
+        "--power-budget",
+        dest="power_budget",
+        type=float,
+        help="If defined will estimate the current drawn by each frame, warn the first time it is over "
+        "this many milliamps and print a summary at exit.",
+    )
+    parser.add_argument(
+        "--power-auto-scale",
+        dest="power_auto_scale",
+        action="store_true",
+        help="If true frames over --power-budget are dimmed to fit the budget before they are shown and recorded.",
+    )
+    parser.add_argument(
+        "--milliamps-per-channel",
+        dest="milliamps_per_channel",
+        type=float,
+        default=MILLIAMPS_PER_CHANNEL,
+        help="The current each channel of an LED draws at full brightness. Used by --power-budget.",
+    )
+    parser.add_argument(
+        "--virtual-time",
+        dest="virtual_time",
+        action="store_true",
+        help="If true the simulation runs on a virtual clock. "
+        "time.time, time.perf_counter, time.monotonic and time.sleep are replaced so that waiting "
+        "advances the clock instantly. Useful to generate animation files faster than real time.",
+    )
+    parser.add_argument(
+        "--fps",
+        dest="fps",
+        type=float,
+        help="With --virtual-time a show call is 1/fps seconds of virtual time after the previous one "
+        "if nothing waited in between. Defaults to 30.",
+        default=30,
+    )
+    parser.add_argument(
+        "--pacing-report",
+        dest="pacing_report",
+        action="store_true",
+        help="If true will print how accurately the frame and show delays were waited for at exit.",
+    )
+    parser.add_argument(
+        "--perf-report",
+        dest="perf_report",
+        type=str,
+        help="If defined will record the compute time, slack and show time of each frame "
+        "and write a summary to this path at exit. Paths ending .json get a JSON report. Use - to print it.",
+    )
+    parser.add_argument(
+        "--render-path",
+        dest="render_path",
+        type=str,
+        help="If defined the frames are drawn offscreen at --render-fps frames per second. "
+        "Paths ending .rgb or .raw get raw rgb24 video. - writes raw rgb24 video to stdout "
+        "and the simulator messages go to stderr. Anything else is a directory of PNG files.",
+    )
+    parser.add_argument(
+        "--render-size",
+        dest="render_size",
+        type=int,
+        nargs=2,
+        default=[640, 640],
+        help="The width and height of the images drawn with --render-path.",
+    )
+    parser.add_argument(
+        "--render-fps",
+        dest="render_fps",
+        type=float,
+        default=30,
+        help="The frame rate of the images drawn with --render-path.",
+    )
+    parser.add_argument(
+        "--render-rotation",
+        dest="render_rotation",
+        type=float,
+        default=0.0,
+        help="The number of turns the --render-path camera makes around the tree per second.",
+    )
     parser.add_argument(
         "--no-gui",
         dest="gui",
@@ -61,6 +198,18 @@ def get_parser():
     return parser
 
 
+# The parsed command line inputs. Set by get_args.
+_args: Optional[argparse.Namespace] = None
+
+
+def get_args() -> argparse.Namespace:
+    """The command line inputs. They are parsed the first time this is called."""
+    global _args
+    if _args is None:
+        _args, _ = get_parser().parse_known_args()
+    return _args
+
+
 # Pixel color order constants
 RGB = "RGB"
 """Red Green Blue"""
@@ -90,6 +239,192 @@ def get_coords(path: str) -> List[Tuple[float, float, float]]:
     return coords
 
 
+class VirtualClock:
+    """
+    A simulated clock that only advances when the program waits.
+    install replaces the functions in the time module so that the user's code uses this clock.
+    """
+
+    def __init__(self):
+        # The amount of virtual time that has passed
+        self._elapsed = 0.0
+        # The number of times the program has waited, including waits for times that have already passed
+        self.wait_count = 0
+        self._time_start = time.time()
+        self._perf_counter_start = time.perf_counter()
+        self._monotonic_start = time.monotonic()
+
+    def install(self):
+        time.time = self.time
+        time.perf_counter = self.perf_counter
+        time.monotonic = self.monotonic
+        time.sleep = self.sleep
+
+    def time(self) -> float:
+        return self._time_start + self._elapsed
+
+    def perf_counter(self) -> float:
+        return self._perf_counter_start + self._elapsed
+
+    def monotonic(self) -> float:
+        return self._monotonic_start + self._elapsed
+
+    def sleep(self, seconds: float):
+        if seconds < 0:
+            raise ValueError("sleep length must be non-negative")
+        self.wait_count += 1
+        self._elapsed += seconds
+
+    def advance_to(self, perf_counter_time: float):
+        """Advance the clock to a time from perf_counter. Does nothing if that time has passed."""
+        self.wait_count += 1
+        self._elapsed = max(self._elapsed, perf_counter_time - self._perf_counter_start)
+
+
+# The virtual clock if the --virtual-time CLI option is set.
+# matts_tree_helpers.FrameManager uses this to skip waiting.
+virtual_clock: Optional[VirtualClock] = None
+
+
+class PrecisionSleeper:
+    """
+    Wait until a deadline without keeping a CPU core busy.
+    time.sleep is used for most of the wait. It can wake up late so the last spin_time seconds
+    (plus the typical amount time.sleep wakes up late by) are spent spinning on time.perf_counter.
+    The amount each wait overshoots the deadline is recorded.
+    """
+
+    def __init__(self, spin_time: float = 0.0005):
+        self._spin_time = spin_time
+        # A moving average of how late time.sleep wakes up
+        self._sleep_error = 0.0
+        # Statistics about how late the waits finished
+        self._count = 0
+        self._overshoot_sum = 0.0
+        self._overshoot_square_sum = 0.0
+        self._overshoot_max = 0.0
+
+    def sleep_until(self, deadline: float):
+        """Wait until time.perf_counter() reaches deadline."""
+        if virtual_clock is not None:
+            virtual_clock.advance_to(deadline)
+            return
+        if time.perf_counter() >= deadline:
+            return
+        while True:
+            remaining = deadline - time.perf_counter() - self._spin_time - self._sleep_error
+            if remaining <= 0:
+                break
+            sleep_start = time.perf_counter()
+            time.sleep(remaining)
+            error = time.perf_counter() - sleep_start - remaining
+            self._sleep_error += (max(error, 0.0) - self._sleep_error) * 0.1
+        while time.perf_counter() < deadline:
+            pass
+        self._record_overshoot(time.perf_counter() - deadline)
+
+    async def sleep_until_async(self, deadline: float):
+        """
+        Wait until time.perf_counter() reaches deadline without blocking the event loop.
+        This does not spin so it is only as precise as the event loop timers.
+        """
+        # asyncio is imported here because it is slow to import and only the async code needs it
+        import asyncio
+
+        if virtual_clock is not None:
+            virtual_clock.advance_to(deadline)
+            # still give the other tasks a chance to run
+            await asyncio.sleep(0)
+            return
+        remaining = deadline - time.perf_counter()
+        await asyncio.sleep(max(remaining, 0.0))
+        if remaining > 0:
+            self._record_overshoot(max(time.perf_counter() - deadline, 0.0))
+
+    def _record_overshoot(self, overshoot: float):
+        self._count += 1
+        self._overshoot_sum += overshoot
+        self._overshoot_square_sum += overshoot ** 2
+        self._overshoot_max = max(self._overshoot_max, overshoot)
+
+    def summary(self) -> str:
+        """A summary of the overshoot and jitter (standard deviation of the overshoot) of the waits."""
+        if not self._count:
+            return "Pacing: no waits recorded."
+        mean = self._overshoot_sum / self._count
+        jitter = max(self._overshoot_square_sum / self._count - mean ** 2, 0.0) ** 0.5
+        return (
+            f"Pacing: {self._count} waits. "
+            f"Overshoot mean {mean * 1e6:.1f}us max {self._overshoot_max * 1e6:.1f}us. "
+            f"Jitter {jitter * 1e6:.1f}us."
+        )
+
+
+# Used by show and matts_tree_helpers.FrameManager to wait for the end of the frame.
+sleeper = PrecisionSleeper()
+
+# The WS2811 data rate is 800kHz
+WS2811_BIT_TIME = 1.25e-6
+# The low time at the end of a frame that latches the data. 50us for the WS2811. Some newer LEDs need 280us.
+WS2811_RESET_TIME = 50e-6
+
+
+class WS2811Timing:
+    """
+    Models the time the real LEDs take to receive a frame.
+    Each pixel is sent as 8 bits per channel at 800kHz followed by a reset.
+    If the LEDs are split between several data lines they are sent in parallel so the longest line sets the time.
+    """
+
+    def __init__(self, pixel_count: int, bytes_per_pixel: int = 3, segments: int = 1):
+        self.pixel_count = pixel_count
+        self.bytes_per_pixel = bytes_per_pixel
+        self.segments = max(segments, 1)
+        # the number of pixels on the longest data line
+        pixels_per_segment = -(-pixel_count // self.segments)
+        self.show_time = pixels_per_segment * bytes_per_pixel * 8 * WS2811_BIT_TIME + WS2811_RESET_TIME
+        self._warned = False
+
+    @property
+    def max_fps(self) -> float:
+        """The highest frame rate the LEDs can be updated at."""
+        return 1 / self.show_time
+
+    def summary(self) -> str:
+        return (
+            f"WS2811 timing: {self.pixel_count} pixels, {self.bytes_per_pixel * 8} bits per pixel, "
+            f"{self.segments} segment{'s' if self.segments > 1 else ''}. "
+            f"show takes {self.show_time * 1000:.2f}ms. Max {self.max_fps:.1f} fps."
+        )
+
+    def check_frame_time(self, frame_time: float):
+        """Print a warning the first time a frame time is shorter than the time to send a frame."""
+        if frame_time < self.show_time and not self._warned:
+            self._warned = True
+            print(
+                f"Warning: the frame time of {frame_time * 1000:.2f}ms ({1 / frame_time:.1f} fps) "
+                f"is shorter than the {self.show_time * 1000:.2f}ms the real LEDs take to receive a frame. "
+                f"The real tree can do at most {self.max_fps:.1f} fps."
+            )
+
+
+# The timing model of the last NeoPixel created.
+# matts_tree_helpers.FrameManager checks its frame time against this.
+hardware_timing: Optional[WS2811Timing] = None
+
+# The frame profiler if the --perf-report CLI option is set.
+# matts_tree_helpers.FrameManager reports the start and end of each frame to this.
+profiler: Optional[FrameProfiler] = None
+
+
+def _to_uint8(colours) -> numpy.ndarray:
+    """Clamp and truncate colour values to the uint8 range. Matches the scalar conversion in __setitem__."""
+    colours = numpy.asarray(colours)
+    if colours.dtype == numpy.uint8:
+        return colours
+    return numpy.clip(numpy.trunc(colours), 0, 255).astype(numpy.uint8)
+
+
 class Exit:
     pass
 
@@ -98,12 +433,73 @@ class Locations(list):
     pass
 
 
-class Pixels(list):
-    pass
+class FrameBuffer:
+    """
+    A double buffer in shared memory used to give frames to the matplotlib process.
+    Writing a frame is a single copy and the reader only ever sees the newest frame.
+    The sequence number is incremented after each write. The reader retries if it changed during the read.
+    """
+
+    def __init__(self, pixel_count: int, name: Optional[str] = None):
+        # If name is not defined a new block of shared memory is created
+        self._shared_memory = SharedMemory(
+            name=name, create=name is None, size=8 + 2 * pixel_count * 3
+        )
+        self._sequence = numpy.ndarray(
+            (1,), dtype=numpy.uint64, buffer=self._shared_memory.buf
+        )
+        self._frames = numpy.ndarray(
+            (2, pixel_count, 3),
+            dtype=numpy.uint8,
+            buffer=self._shared_memory.buf,
+            offset=8,
+        )
 
+    @property
+    def name(self) -> str:
+        return self._shared_memory.name
+
+    def write(self, frame: numpy.ndarray):
+        """Write a (n, 3) uint8 frame into the buffer."""
+        sequence = int(self._sequence[0]) + 1
+        self._frames[sequence % 2] = frame
+        self._sequence[0] = sequence
 
-def matplotlib_process(command_queue: Queue):
+    def read(self, last_sequence: int) -> Tuple[int, Optional[numpy.ndarray]]:
+        """
+        Read the newest frame.
+        Returns the sequence number and a copy of the frame or None if there is no frame newer than last_sequence.
+        """
+        while True:
+            sequence = int(self._sequence[0])
+            if sequence == last_sequence:
+                return sequence, None
+            frame = self._frames[sequence % 2].copy()
+            if int(self._sequence[0]) == sequence:
+                return sequence, frame
+
+    def close(self, unlink: bool = False):
+        # the numpy arrays must be released before the memory can be closed
+        del self._sequence, self._frames
+        self._shared_memory.close()
+        if unlink:
+            self._shared_memory.unlink()
+
+
+def matplotlib_process(command_queue: Queue, frame_buffer_name: str, pixel_count: int):
     """Run matplotlib in a new process."""
+    import matplotlib
+
+    # without this PyCharm displays it as an image that does not update.
+    matplotlib.use("TkAgg")
+    import matplotlib.pyplot as plt
+
+    # set the style
+    plt.style.use("dark_background")
+
+    frame_buffer = FrameBuffer(pixel_count, frame_buffer_name)
+    frame_sequence = 0
+
     # create a figure
     fig = plt.figure()
     ax = fig.add_subplot(projection="3d")
@@ -121,6 +517,12 @@ def matplotlib_process(command_queue: Queue):
     pixels = None
     locations_changed = False
     locations = None
+    # The scatter plot is created once when the locations are set. Later frames only change the colours.
+    scatter = None
+
+    # track the achieved render frame rate
+    render_count = 0
+    render_count_start = time.perf_counter()
 
     while run:
         while True:
@@ -135,55 +537,83 @@ def matplotlib_process(command_queue: Queue):
                 elif isinstance(command, Locations):
                     locations_changed = True
                     locations = command
-                elif isinstance(command, Pixels):
-                    pixels_changed = True
-                    pixels = command
                 else:
                     print(command)
 
+        frame_sequence, frame = frame_buffer.read(frame_sequence)
+        if frame is not None and (pixels is None or not numpy.array_equal(frame, pixels)):
+            pixels_changed = True
+            pixels = frame
+
         if locations_changed:
+            ax.cla()
             ax.set_box_aspect([max(ax) - min(ax) for ax in locations])
+            scatter = ax.scatter(*locations, c="black")
+            pixels_changed = pixels is not None
             locations_changed = False
         if pixels_changed:
-            if locations is None:
+            if scatter is None:
                 print(
                     "The LED locations have not been set. "
                     "These can be set via the CLI or by calling set_pixel_locations"
                 )
             else:
-                ax.cla()
-                ax.scatter(*locations, c=pixels)
+                # This marks the figure as stale so it is redrawn in the pause call below.
+                scatter.set_facecolor(pixels / 255)
                 pixels_changed = False
+                render_count += 1
+
+        now = time.perf_counter()
+        if now - render_count_start >= 1:
+            fig.canvas.manager.set_window_title(
+                f"Neopixel Simulator - {render_count / (now - render_count_start):.1f} FPS"
+            )
+            render_count = 0
+            render_count_start = now
 
         plt.pause(1 / 100_000)
     plt.close(fig)
+    frame_buffer.close()
 
 
 class NeoPixel:
     _pixel_count: int  # The number of pixels the devices has
     _channel_map: Tuple[int, int, int]  # RGB indexes
+    _bpp: int  # The number of bytes per pixel. 4 if there is a white channel
+    _pixels: numpy.ndarray  # (n, bpp) uint8 array of colours in pixel_order
 
     _process: Optional[Process]  # The matplotlib process
-    _process_queue: Optional[Queue]  # A Queue used to send data to the matplotlib process
+    _process_queue: Optional[Queue]  # A Queue used to send commands to the matplotlib process
+    _frame_buffer: Optional[FrameBuffer]  # Shared memory used to send frames to the matplotlib process
 
     def __init__(self, _, pixel_count: int, *, pixel_order: str = "GRB", **kwargs):
         super().__init__()
         self._pixel_count = pixel_count
-        if pixel_order == "RGB":
+        if pixel_order in ("RGB", "RGBW"):
             self._channel_map = (0, 1, 2)
-        elif pixel_order == "GRB":
+        elif pixel_order in ("GRB", "GRBW"):
             self._channel_map = (1, 0, 2)
         else:
-            raise ValueError("pixel_order must be RGB or GRB")
+            raise ValueError("pixel_order must be RGB, GRB, RGBW or GRBW")
+        self._bpp = len(pixel_order)
 
-        # the LED colours
-        self._pixels = [(0, 0, 0)] * pixel_count
+        # the LED colours in pixel_order. These are remapped to RGB once per frame in show.
+        self._pixels = numpy.zeros((pixel_count, self._bpp), dtype=numpy.uint8)
 
         # parse the CLI inputs
-        parser_args, _ = get_parser().parse_known_args()
+        parser_args = get_args()
+        if parser_args.render_path == "-":
+            # stdout is the video stream so the messages are printed to stderr
+            sys.stdout = sys.stderr
 
         # The delay time used in the show method
         self._show_delay = parser_args.show_delay
+        # Model the time the real LEDs take to receive each frame
+        global hardware_timing
+        hardware_timing = WS2811Timing(pixel_count, self._bpp, parser_args.strip_segments)
+        if parser_args.hardware_timing:
+            self._show_delay = hardware_timing.show_time
+            print(hardware_timing.summary())
 
         # Optional argument. The path to save the frame data to at exit.
         self._save_path = parser_args.animation_csv_save_path
@@ -191,21 +621,57 @@ class NeoPixel:
         self._frame_data = []
         self._frame_times = []
         self._last_draw_time = None
+        # The last frame shown. This is recorded when the next frame is shown and its duration is known.
+        self._last_frame = None
+        # The indexes of the LEDs in the last frame that changed since the frame before it
+        self._last_frame_changed = None
+        # Optional argument. Record repeated frames as one longer frame.
+        self._merge_frames = parser_args.merge_identical_frames
+        # The time of the last show call merged into the last frame. None if no frames are merged.
+        self._merged_time = None
+        # Write the frames to animation files as they are produced.
+        self._animation_writers: List[AnimationWriter] = []
 
         # Set up the animation save if requested
-        if self._save_path is not None:
-            # register the csv save method when python exits
-            atexit.register(self._save_animation_csv)
+        if self._save_path is not None and parser_args.stream_animation:
+            self._animation_writers.append(
+                CSVAnimationWriter(self._save_path, pixel_count)
+            )
+            # The frames do not need to be stored.
+            self._save_path = None
+        if parser_args.animation_bin_save_path is not None:
+            if parser_args.compress_animation:
+                writer_class = CompressedBinaryAnimationWriter
+            else:
+                writer_class = BinaryAnimationWriter
+            self._animation_writers.append(
+                writer_class(parser_args.animation_bin_save_path, pixel_count)
+            )
+        self._recording = self._save_path is not None or bool(self._animation_writers)
+        if self._recording:
+            # register the save method when python exits
+            atexit.register(self._save_animation)
+        # Optional argument. The offscreen renderer is created when the pixel locations are set.
+        self._render_path = parser_args.render_path
+        self._render_size = parser_args.render_size
+        self._render_rotation = parser_args.render_rotation
+        self._render_fps = parser_args.render_fps
 
         # Enable the GUI if required
         self._gui = parser_args.gui
         if self._gui:
             # start the UI thread
             self._process_queue = Queue()
-            self._process = Process(target=matplotlib_process, args=(self._process_queue,))
+            self._frame_buffer = FrameBuffer(pixel_count)
+            atexit.register(self._frame_buffer.close, True)
+            self._process = Process(
+                target=matplotlib_process,
+                args=(self._process_queue, self._frame_buffer.name, pixel_count),
+            )
             self._process.start()
         else:
             self._process_queue = None
+            self._frame_buffer = None
             self._process = None
             print("Running in no GUI mode.")
 
@@ -213,11 +679,53 @@ class NeoPixel:
         if parser_args.coordinates_path is not None:
             self.set_pixel_locations(get_coords(parser_args.coordinates_path))
 
+        # Optional argument. Estimate the current drawn by each frame.
+        if parser_args.power_budget is not None:
+            self._power_monitor = PowerMonitor(
+                PowerModel(parser_args.milliamps_per_channel),
+                parser_args.power_budget,
+                parser_args.power_auto_scale,
+            )
+            atexit.register(lambda: print(self._power_monitor.summary()))
+        else:
+            self._power_monitor = None
+
+        # Optional argument. Print the accuracy of the waits at exit.
+        if parser_args.pacing_report:
+            atexit.register(lambda: print(sleeper.summary()))
+
+        # Optional argument. Record the frame timings and write a report at exit.
+        global profiler
+        if parser_args.perf_report is not None and profiler is None:
+            profiler = FrameProfiler()
+            atexit.register(profiler.write_report, parser_args.perf_report)
+        # The number of pixel writes since the last show call
+        self._setitem_count = 0
+        # The RGB frame given to the GUI and recorders by the last show call
+        self._shown_frame: Optional[numpy.ndarray] = None
+        # The indexes of the pixels the last show call changed
+        self._changed_indices = numpy.arange(pixel_count)
+
+        # Optional argument. Run on a virtual clock.
+        # This is set up after the GUI process has started so that the GUI runs in real time.
+        global virtual_clock
+        if parser_args.virtual_time and virtual_clock is None:
+            virtual_clock = VirtualClock()
+            virtual_clock.install()
+        # The minimum virtual time between show calls
+        self._virtual_frame_time = 1 / parser_args.fps
+        self._last_show_time = None
+        # The virtual clock wait count when the last show call finished
+        self._shown_wait_count = None
+
         # Optional argument. The number of seconds to simulate. Exit after this amount of time.
         if parser_args.simulate_seconds is not None:
             self._end_time = time.perf_counter() + parser_args.simulate_seconds
         else:
             self._end_time = None
+        # Optional argument. The number of frames to simulate. Exit after this many frames.
+        self._end_frame = parser_args.simulate_frames
+        self._frame_count = 0
 
     def set_pixel_locations(self, coords: Iterable[Tuple[float, float, float]]):
         """
@@ -241,6 +749,26 @@ class NeoPixel:
             raise ValueError("Coords must be of the form List[Tuple[int, int, int]]")
         if self._process_queue is not None:
             self._process_queue.put_nowait(Locations(zip(*coords)))
+        if self._render_path is not None:
+            self._start_offscreen_render(coords)
+
+    def _start_offscreen_render(self, coords: List[Tuple[float, float, float]]):
+        """Draw the frames offscreen from now on. Only the first locations set are used."""
+        width, height = self._render_size
+        self._animation_writers.append(
+            OffscreenRenderWriter(
+                self._render_path,
+                coords,
+                fps=self._render_fps,
+                width=width,
+                height=height,
+                rotation=self._render_rotation,
+            )
+        )
+        self._render_path = None
+        if not self._recording:
+            self._recording = True
+            atexit.register(self._save_animation)
 
     @property
     def n(self) -> int:
@@ -249,14 +777,114 @@ class NeoPixel:
         """
         return self._pixel_count
 
+    @property
+    def changed(self) -> bool:
+        """
+        Custom property. True if the last show call changed any pixel (read-only)
+        """
+        return len(self._changed_indices) > 0
+
+    @property
+    def changed_indices(self) -> numpy.ndarray:
+        """
+        Custom property. The indexes of the pixels the last show call changed (read-only)
+        """
+        return self._changed_indices
+
+    @property
+    def bpp(self) -> int:
+        """
+        The number of bytes per pixel in the buffer (read-only)
+        """
+        return self._bpp
+
+    def _assign(self, index, colours: numpy.ndarray):
+        """Set pixels from uint8 colours. Colours without a white channel set the white LEDs to 0."""
+        if colours.shape[-1] == self._bpp:
+            self._pixels[index] = colours
+        else:
+            self._pixels[index, :3] = colours
+            self._pixels[index, 3:] = 0
+
     def __setitem__(self, index, color):
-        self._pixels[index] = tuple(color[i] / 255.0 for i in self._channel_map)
+        self._setitem_count += 1
+        if isinstance(index, slice):
+            # a sequence of colours
+            self._assign(index, _to_uint8(color))
+        else:
+            color = tuple(min(max(int(c), 0), 255) for c in color[: self._bpp])
+            # pad RGB colours given to RGBW pixels with no white
+            self._pixels[index] = color + (0,) * (self._bpp - len(color))
+
+    def fill(self, color):
+        """Set all the pixels to the same colour."""
+        self._setitem_count += 1
+        self._assign(slice(None), _to_uint8(color[: self._bpp]))
+
+    def set_all(self, colors: numpy.ndarray):
+        """
+        Custom method to set every pixel in one call.
+        colors must be an array of shape (n, 3) or (n, bpp) in the same channel order as __setitem__.
+        This does not exist in the normal neopixel library so you will need to call it like this
+        try:
+            pixels.set_all(colors)
+        except AttributeError:
+            for i, color in enumerate(colors):
+                pixels[i] = color
+        """
+        colors = numpy.asarray(colors)
+        if colors.shape not in ((self._pixel_count, 3), self._pixels.shape):
+            raise ValueError(
+                f"colors must have shape {self._pixels.shape}. Got {colors.shape}"
+            )
+        self._setitem_count += 1
+        self._assign(slice(None), _to_uint8(colors))
 
     def show(self):
+        delay_end = self._show()
+        # sleep if required
+        if self._show_delay > 0:
+            sleeper.sleep_until(delay_end)
+        self._show_finished()
+
+    async def show_async(self):
+        """
+        Custom method. The same as show but waits for the show delay without blocking the event loop.
+        This does not exist in the normal neopixel library. See matts_tree_helpers.show_async.
+        """
+        import asyncio
+
+        # wait for space in the animation writers so that recording the frame does not block
+        for writer in self._animation_writers:
+            await writer.wait_async()
+        delay_end = self._show()
+        if self._show_delay > 0:
+            await sleeper.sleep_until_async(delay_end)
+        else:
+            await asyncio.sleep(0)
+        self._show_finished()
+
+    def _show_finished(self):
+        if virtual_clock is not None:
+            self._shown_wait_count = virtual_clock.wait_count
+
+    def _show(self) -> float:
+        """Give the frame to the GUI and recorders. Returns the time the show delay ends."""
+        if profiler is not None:
+            profiler.show_started()
+        # Frames that nothing waited for (other than the show delay) are paced at fps.
+        # Frames that were waited for, eg by FrameManager, keep the time that was waited for.
+        if virtual_clock is not None and virtual_clock.wait_count == self._shown_wait_count:
+            virtual_clock.advance_to(self._last_show_time + self._virtual_frame_time)
         current_time = time.perf_counter()
+        self._last_show_time = current_time
 
         # check if we should exit
-        if self._end_time is not None and current_time > self._end_time:
+        # A frame is recorded when the next show call happens so exit on the second show call after the last frame.
+        self._frame_count += 1
+        if (self._end_time is not None and current_time > self._end_time) or (
+            self._end_frame is not None and self._frame_count > self._end_frame + 1
+        ):
             if self._process is not None:
                 if self._process.is_alive():
                     # if the matplotlib process is running then kill it
@@ -265,49 +893,86 @@ class NeoPixel:
             sys.exit(0)
         elif self._process is not None and not self._process.is_alive():
             # The matplotlib process has exited. We should exit.
-            if self._save_path is not None:
+            if self._recording:
                 # There is an issue where if the process is exited it will get stuck. This fixes it.
-                atexit.unregister(self._save_animation_csv)
-                self._save_animation_csv()
+                atexit.unregister(self._save_animation)
+                self._save_animation()
             # There is sometimes an error that gets printed to the console. I am not sure how to fix this
             # https://stackoverflow.com/questions/26692284/how-to-prevent-brokenpipeerror-when-doing-a-flush-in-python
             sys.stderr.close()
             sys.exit(0)
 
+        # remap the colours to RGB
+        frame = self._pixels[:, self._channel_map]
+        if self._bpp == 4:
+            # show the white LED as an equal amount of red, green and blue
+            frame = numpy.minimum(frame + self._pixels[:, 3:].astype(numpy.uint16), 255).astype(
+                numpy.uint8
+            )
+        if self._power_monitor is not None:
+            frame = self._power_monitor.check(self._pixels, frame)
+
+        # find the pixels that changed since the last frame
+        if self._shown_frame is None:
+            self._changed_indices = numpy.arange(self._pixel_count)
+        else:
+            self._changed_indices = numpy.flatnonzero(
+                numpy.any(frame != self._shown_frame, axis=1)
+            )
+        self._shown_frame = frame
+
         # update the save data if we are storing that.
+        if self._recording:
+            if self._merge_frames and self._last_draw_time is not None and not self.changed:
+                # extend the last frame rather than recording the same frame again
+                self._merged_time = current_time
+            else:
+                # the last frame can be stored now that we know how long it was displayed for
+                if self._last_draw_time is not None:
+                    self._record_last_frame(current_time - self._last_draw_time)
+                self._last_draw_time = current_time
+                self._last_frame = frame
+                self._last_frame_changed = self._changed_indices
+                self._merged_time = None
+
+        # give the pixel data to the process if it changed
+        if self._frame_buffer is not None and self.changed:
+            self._frame_buffer.write(frame)
+
+        if profiler is not None:
+            profiler.show_finished(self._setitem_count)
+        self._setitem_count = 0
+        return current_time + self._show_delay
+
+    def _record_last_frame(self, frame_time: float):
         if self._save_path is not None:
-            # update the frame times
-            if self._last_draw_time is not None:
-                self._frame_times.append(current_time - self._last_draw_time)
-            self._last_draw_time = current_time
-            # update the frame data
-            self._frame_data.append(self._pixels.copy())
-
-        # give the pixel data to the process
-        if self._process_queue is not None:
-            self._process_queue.put_nowait(Pixels(self._pixels))
-
-        # sleep if required
-        end_time = current_time + self._show_delay
-        while time.perf_counter() < end_time:
-            # time.sleep has inaccuracies on some platforms
-            pass
+            self._frame_times.append(frame_time)
+            self._frame_data.append(self._last_frame)
+        for writer in self._animation_writers:
+            writer.write(frame_time, self._last_frame, self._last_frame_changed)
+
+    def _save_animation(self):
+        # the frames merged into the last frame are recorded up to the last show call
+        if self._merged_time is not None:
+            self._record_last_frame(self._merged_time - self._last_draw_time)
+            self._merged_time = None
+        # the streamed files only need the queued frames writing
+        for writer in self._animation_writers:
+            writer.close()
+        if self._save_path is not None:
+            self._save_animation_csv()
 
     def _save_animation_csv(self):
         with open(self._save_path, "w") as f:
-            colour_header_names = ",".join(
-                f"{channel}_{led}"
-                for led in range(self._pixel_count)
-                for channel in "RGB"
-            )
-            f.write(f"FRAME_TIME,{colour_header_names}\n")
-            for frame_time, frame in zip(self._frame_times, self._frame_data):
-                colour_data = ",".join(
-                    str(min(max(int(col * 255), 0), 255))
-                    for led in frame
-                    for col in led
+            f.write(csv_header(self._pixel_count))
+            # format the frames in blocks to limit the memory used
+            for start in range(0, len(self._frame_data), CSV_BLOCK_SIZE):
+                end = start + CSV_BLOCK_SIZE
+                f.write(
+                    format_csv_rows(
+                        self._frame_times[start:end], self._frame_data[start:end]
+                    )
                 )
-                f.write(f"{round(frame_time*1000, 3)},{colour_data}\n")
 
 
 if __name__ == "__main__":
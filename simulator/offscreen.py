@@ -0,0 +1,316 @@
+"""
+Render animations to images without a window so that previews can be made on machines without a display.
+
+python offscreen.py animation.csv --coordinates-path coords_2021.csv --output frames
+
+Each LED is drawn as a disc from a fixed camera that can optionally rotate around the tree.
+Where discs overlap the brightest value of each channel is kept.
+The frames are resampled to a fixed frame rate and written as a sequence of PNG files or as raw rgb24 video.
+Raw video can be piped straight into ffmpeg.
+
+python offscreen.py animation.csv --coordinates-path coords_2021.csv --output - | \\
+    ffmpeg -f rawvideo -pix_fmt rgb24 -s 640x640 -r 30 -i - preview.mp4
+
+Live runs can be rendered with the --render-path neopixel command line option.
+"""
+
+from typing import List, Sequence, Tuple, BinaryIO, Optional
+import argparse
+import math
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy
+
+from animation_file import AnimationWriter, iter_animation
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + chunk_type
+        + data
+        + struct.pack(">I", zlib.crc32(chunk_type + data))
+    )
+
+
+def encode_png(image: numpy.ndarray, compress_level: int = 3) -> bytes:
+    """Encode a (height, width, 3) uint8 RGB image as a PNG file."""
+    height, width, _ = image.shape
+    # each row starts with the filter type. 0 is no filter.
+    rows = numpy.zeros((height, width * 3 + 1), dtype=numpy.uint8)
+    rows[:, 1:] = image.reshape(height, width * 3)
+    return (
+        _PNG_SIGNATURE
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(rows.tobytes(), compress_level))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+class OffscreenRenderer:
+    """
+    Draws the LEDs into an image buffer.
+
+    The camera looks at the middle of the tree from the side, tilted down by elevation degrees.
+    The scale is fixed so that the tree fits in the image at every rotation.
+    """
+
+    def __init__(
+        self,
+        coords,
+        width: int = 640,
+        height: int = 640,
+        led_size: float = 3,
+        elevation: float = 10,
+        rotation: float = 0.0,
+    ):
+        """
+        :param coords: The (n, 3) LED coordinates. z is the vertical axis.
+        :param width: The width of the images in pixels.
+        :param height: The height of the images in pixels.
+        :param led_size: The radius of each LED in pixels.
+        :param elevation: The angle the camera looks down at the tree in degrees.
+        :param rotation: The number of turns the camera makes around the tree per second.
+        """
+        coords = numpy.asarray(coords, dtype=float)
+        self.width = width
+        self.height = height
+        self._rotation = rotation
+        self._elevation = math.radians(elevation)
+        low = coords.min(axis=0)
+        high = coords.max(axis=0)
+        centre = (low + high) / 2
+        self._x = coords[:, 0] - centre[0]
+        self._y = coords[:, 1] - centre[1]
+        self._z = coords[:, 2] - centre[2]
+        radius = max(float(numpy.hypot(self._x, self._y).max()), 1e-9)
+        # the extent of the tree on the screen at any rotation
+        screen_width = 2 * radius
+        screen_height = (high[2] - low[2]) * math.cos(self._elevation) + 2 * radius * math.sin(
+            self._elevation
+        )
+        margin = 2 * led_size + 1
+        self._scale = min(
+            (width - 2 * margin) / screen_width,
+            (height - 2 * margin) / max(screen_height, 1e-9),
+        )
+        # the pixel offsets of a disc of radius led_size
+        size = math.ceil(led_size)
+        dy, dx = numpy.mgrid[-size : size + 1, -size : size + 1]
+        inside = dx ** 2 + dy ** 2 <= led_size ** 2
+        self._disc_x = dx[inside]
+        self._disc_y = dy[inside]
+
+    def project(self, t: float = 0.0) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """The pixel column and row of each LED at time t."""
+        angle = 2 * math.pi * self._rotation * t
+        cos_angle = math.cos(angle)
+        sin_angle = math.sin(angle)
+        across = self._x * cos_angle - self._y * sin_angle
+        depth = self._x * sin_angle + self._y * cos_angle
+        up = self._z * math.cos(self._elevation) - depth * math.sin(self._elevation)
+        columns = numpy.rint(self.width / 2 + across * self._scale).astype(int)
+        rows = numpy.rint(self.height / 2 - up * self._scale).astype(int)
+        return columns, rows
+
+    def render(self, frame: numpy.ndarray, t: float = 0.0) -> numpy.ndarray:
+        """
+        Draw a frame.
+
+        :param frame: The (n, 3) uint8 RGB colours.
+        :param t: The time of the frame in seconds. Used for the rotation.
+        :return: A (height, width, 3) uint8 RGB image.
+        """
+        columns, rows = self.project(t)
+        columns = (columns[:, None] + self._disc_x).ravel()
+        rows = (rows[:, None] + self._disc_y).ravel()
+        colours = numpy.repeat(numpy.asarray(frame, dtype=numpy.uint8), len(self._disc_x), axis=0)
+        visible = (columns >= 0) & (columns < self.width) & (rows >= 0) & (rows < self.height)
+        image = numpy.zeros((self.height * self.width, 3), dtype=numpy.uint8)
+        numpy.maximum.at(image, rows[visible] * self.width + columns[visible], colours[visible])
+        return image.reshape(self.height, self.width, 3)
+
+
+class FrameResampler:
+    """Converts frames that are displayed for different durations to a fixed frame rate."""
+
+    def __init__(self, fps: float):
+        self._fps = fps
+        self._elapsed = 0.0
+        self._count = 0
+
+    def image_times(self, duration: float) -> List[float]:
+        """The times of the images that show the next frame which is displayed for duration seconds."""
+        end = self._elapsed + duration
+        times = []
+        while self._count / self._fps < end:
+            times.append(self._count / self._fps)
+            self._count += 1
+        self._elapsed = end
+        return times
+
+
+class ImageSink:
+    """
+    Writes the images to a PNG sequence or a raw rgb24 stream.
+    Paths ending .rgb or .raw and - (stdout) get raw video. Anything else is a directory of PNG files.
+    - writes to the original stdout even if sys.stdout has been redirected to keep messages out of the video.
+    """
+
+    def __init__(self, path: str):
+        self._count = 0
+        self._directory = None
+        self._stream: BinaryIO
+        if path == "-":
+            self._stream = sys.__stdout__.buffer
+        elif path.endswith((".rgb", ".raw")):
+            self._stream = open(path, "wb")
+        else:
+            self._directory = path
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, image: numpy.ndarray):
+        if self._directory is None:
+            self._stream.write(image.tobytes())
+        else:
+            with open(os.path.join(self._directory, f"frame_{self._count:06d}.png"), "wb") as f:
+                f.write(encode_png(image))
+        self._count += 1
+
+    def flush(self):
+        if self._directory is None:
+            self._stream.flush()
+
+    def close(self):
+        self.flush()
+        if self._directory is None and self._stream is not sys.__stdout__.buffer:
+            self._stream.close()
+
+    @property
+    def count(self) -> int:
+        """The number of images written."""
+        return self._count
+
+
+class OffscreenRenderWriter(AnimationWriter):
+    """Renders the frames of a live run on the writer thread. Used by the --render-path neopixel option."""
+
+    def __init__(
+        self,
+        path: str,
+        coords,
+        *,
+        fps: float = 30,
+        width: int = 640,
+        height: int = 640,
+        rotation: float = 0.0,
+        **kwargs,
+    ):
+        self._renderer = OffscreenRenderer(coords, width, height, rotation=rotation)
+        self._resampler = FrameResampler(fps)
+        self._rotation = rotation
+        # The last image drawn. It is reused while nothing changes.
+        self._last_image: Optional[numpy.ndarray] = None
+        self._image_stale = True
+        super().__init__(path, len(coords), **kwargs)
+
+    def _open(self):
+        return ImageSink(self._path)
+
+    def _write_frames(
+        self,
+        frame_times: Sequence[float],
+        frames: Sequence[numpy.ndarray],
+        changed: Sequence[Optional[numpy.ndarray]],
+    ):
+        for frame_time, frame, frame_changed in zip(frame_times, frames, changed):
+            if frame_changed is None or len(frame_changed):
+                self._image_stale = True
+            for t in self._resampler.image_times(frame_time):
+                # the image only needs drawing again if the LEDs or the camera moved
+                if self._image_stale or self._rotation:
+                    self._last_image = self._renderer.render(frame, t)
+                    self._image_stale = False
+                self._file.write(self._last_image)
+
+
+def render_animation(
+    animation_path: str,
+    renderer: OffscreenRenderer,
+    output_path: str,
+    fps: float = 30,
+) -> int:
+    """Render an animation file to output_path. Returns the number of images written."""
+    sink = ImageSink(output_path)
+    resampler = FrameResampler(fps)
+    try:
+        for frame_time, frame in iter_animation(animation_path):
+            # the animation files store the frame time in milliseconds
+            for t in resampler.image_times(frame_time / 1000):
+                sink.write(renderer.render(frame, t))
+    finally:
+        sink.close()
+    return sink.count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render an animation file to a PNG sequence or raw rgb24 video without a window."
+    )
+    parser.add_argument("path", type=str, help="The animation file to render.")
+    parser.add_argument(
+        "--coordinates-path",
+        type=str,
+        required=True,
+        help="The coordinates of the LEDs in txt or csv format.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=True,
+        help="A directory to write PNG files to. Paths ending .rgb or .raw and - (stdout) get raw rgb24 video.",
+    )
+    parser.add_argument("--fps", type=float, default=30, help="The frame rate of the images.")
+    parser.add_argument(
+        "--size", type=int, nargs=2, default=[640, 640], help="The width and height of the images."
+    )
+    parser.add_argument(
+        "--led-size", type=float, default=3, help="The radius of each LED in pixels."
+    )
+    parser.add_argument(
+        "--elevation",
+        type=float,
+        default=10,
+        help="The angle the camera looks down at the tree in degrees.",
+    )
+    parser.add_argument(
+        "--rotation",
+        type=float,
+        default=0.0,
+        help="The number of turns the camera makes around the tree per second.",
+    )
+    args = parser.parse_args()
+
+    from neopixel import get_coords
+
+    renderer = OffscreenRenderer(
+        get_coords(args.coordinates_path),
+        *args.size,
+        led_size=args.led_size,
+        elevation=args.elevation,
+        rotation=args.rotation,
+    )
+    start = time.perf_counter()
+    count = render_animation(args.path, renderer, args.output, args.fps)
+    # stdout may be the video stream
+    print(f"Rendered {count} images in {time.perf_counter() - start:.1f}s.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Play an animation file in the simulator visualiser without running the code that created it.
+
+python player.py animation.csv --coordinates-path coords_2021.csv
+
+The file is read one frame at a time so long animations do not need to be loaded into memory.
+The other neopixel command line options such as --no-gui and --simulate-seconds also work here.
+"""
+
+import time
+
+import neopixel
+from animation_file import iter_animation, get_animation_pixel_count
+
+
+def play(path: str, loop: bool = False):
+    """Play the animation file at path. Each frame is shown for its FRAME_TIME."""
+    pixels = neopixel.NeoPixel(None, get_animation_pixel_count(path), pixel_order="RGB")
+    next_frame_time = time.perf_counter()
+    while True:
+        for frame_time, frame in iter_animation(path):
+            pixels.set_all(frame)
+            pixels.show()
+            next_frame_time += frame_time / 1000
+            neopixel.sleeper.sleep_until(next_frame_time)
+        if not loop:
+            break
+    # The frame time of the last frame is only known when the next frame is shown.
+    # Show it again so that it is included if the animation is being saved.
+    pixels.show()
+
+
+def main():
+    # extend the neopixel parser so that its options show up in the help
+    parser = neopixel.get_parser()
+    parser.description = (
+        "Play an animation file in the simulator. "
+        "Files ending .csv are CSV files. Anything else is binary."
+    )
+    parser.add_argument("path", type=str, help="The animation file to play.")
+    parser.add_argument(
+        "--loop",
+        action="store_true",
+        help="If true the animation is repeated until the window is closed.",
+    )
+    args = parser.parse_args()
+    play(args.path, args.loop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Estimate the current the real LEDs draw so that animations do not overload the power supply.
+
+python power.py animation.csv --budget 10000
+
+Each channel of each LED draws up to milliamps_per_channel at full brightness, in proportion to its value,
+and every LED draws idle_milliamps even when it is off.
+The peak and average current of the animation and the frames over the budget are reported.
+With --scale-to a copy of the animation is written with the over budget frames dimmed to fit the budget.
+
+Live runs can be checked with the --power-budget neopixel command line option.
+"""
+
+from typing import Iterator, Tuple, Optional, List
+import argparse
+import json
+
+import numpy
+
+from animation_file import iter_animation, open_animation_writer, get_animation_pixel_count
+
+# The current each channel of a WS2811 LED draws at full brightness in milliamps
+MILLIAMPS_PER_CHANNEL = 20.0
+# The current each LED draws when it is off in milliamps
+IDLE_MILLIAMPS = 1.0
+# The number of frames processed at once
+POWER_BLOCK_SIZE = 256
+
+
+class PowerModel:
+    """A linear model of the current drawn by the LEDs."""
+
+    def __init__(
+        self,
+        milliamps_per_channel: float = MILLIAMPS_PER_CHANNEL,
+        idle_milliamps: float = IDLE_MILLIAMPS,
+    ):
+        self.milliamps_per_channel = milliamps_per_channel
+        self.idle_milliamps = idle_milliamps
+
+    def frame_currents(self, frames: numpy.ndarray) -> numpy.ndarray:
+        """
+        The current drawn by each frame in milliamps.
+
+        :param frames: A (frames, n, channels) uint8 array. The channels can include white.
+        """
+        _, pixel_count, _ = frames.shape
+        channel_sums = frames.sum(axis=(1, 2), dtype=numpy.uint64)
+        return channel_sums * (self.milliamps_per_channel / 255) + pixel_count * self.idle_milliamps
+
+    def scale_factors(self, frames: numpy.ndarray, budget: float) -> numpy.ndarray:
+        """The amount each frame must be dimmed by to draw at most budget milliamps. 1 if it is within budget."""
+        _, pixel_count, _ = frames.shape
+        idle = pixel_count * self.idle_milliamps
+        colour_currents = self.frame_currents(frames) - idle
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            factors = (budget - idle) / colour_currents
+        return numpy.clip(numpy.nan_to_num(factors, nan=1.0, posinf=1.0), 0, 1)
+
+
+def scale_frames(frames: numpy.ndarray, factors: numpy.ndarray) -> numpy.ndarray:
+    """Dim each frame by its factor. Values are truncated so the current never goes above the target."""
+    return numpy.trunc(frames * factors[:, None, None]).astype(numpy.uint8)
+
+
+def iter_animation_blocks(
+    path: str, block_size: int = POWER_BLOCK_SIZE
+) -> Iterator[Tuple[numpy.ndarray, numpy.ndarray]]:
+    """Read an animation file in blocks. Yields the frame times in milliseconds and a (frames, n, 3) array."""
+    frame_times = []
+    frames = []
+    for frame_time, frame in iter_animation(path):
+        frame_times.append(frame_time)
+        frames.append(frame)
+        if len(frames) == block_size:
+            yield numpy.asarray(frame_times), numpy.stack(frames)
+            frame_times = []
+            frames = []
+    if frames:
+        yield numpy.asarray(frame_times), numpy.stack(frames)
+
+
+def analyse_animation(
+    path: str,
+    model: PowerModel,
+    budget: Optional[float] = None,
+    scale_path: Optional[str] = None,
+) -> dict:
+    """
+    Estimate the current drawn by an animation file.
+
+    :param path: The animation file.
+    :param model: The power model.
+    :param budget: The maximum current of the power supply in milliamps. Frames above this are reported.
+    :param scale_path: If defined, the animation is written here with the over budget frames dimmed to fit the budget.
+    :return: The peak and average current in milliamps and the frames over budget.
+    """
+    writer = None
+    if scale_path is not None:
+        if budget is None:
+            raise ValueError("A budget is needed to scale the animation.")
+        writer = open_animation_writer(scale_path, get_animation_pixel_count(path))
+    peak = 0.0
+    peak_frame = None
+    charge = 0.0
+    duration = 0.0
+    frame_count = 0
+    over_budget: List[int] = []
+    try:
+        for frame_times, frames in iter_animation_blocks(path):
+            currents = model.frame_currents(frames)
+            block_peak = int(numpy.argmax(currents))
+            if currents[block_peak] > peak or peak_frame is None:
+                peak = float(currents[block_peak])
+                peak_frame = frame_count + block_peak
+            # the average is weighted by how long each frame is shown
+            charge += float(numpy.dot(currents, frame_times))
+            duration += float(frame_times.sum())
+            if budget is not None:
+                over_budget += (numpy.flatnonzero(currents > budget) + frame_count).tolist()
+            if writer is not None:
+                scaled = scale_frames(frames, model.scale_factors(frames, budget))
+                for frame_time, frame in zip(frame_times.tolist(), scaled):
+                    # the writers take the frame time in seconds
+                    writer.write(frame_time / 1000, frame)
+            frame_count += len(frames)
+    finally:
+        if writer is not None:
+            writer.close()
+    return {
+        "frames": frame_count,
+        "peak_milliamps": round(peak, 3),
+        "peak_frame": peak_frame,
+        "average_milliamps": round(charge / duration, 3) if duration else None,
+        "budget_milliamps": budget,
+        "over_budget_frames": len(over_budget),
+        "over_budget_frame_indexes": over_budget,
+    }
+
+
+class PowerMonitor:
+    """
+    Estimates the current of each frame of a live run. Used by the --power-budget neopixel option.
+    If auto_scale is true frames over the budget are dimmed before they are shown and recorded.
+    """
+
+    def __init__(self, model: PowerModel, budget: float, auto_scale: bool = False):
+        self._model = model
+        self._budget = budget
+        self._auto_scale = auto_scale
+        self._currents: List[float] = []
+        self._warned = False
+
+    def check(self, pixels: numpy.ndarray, frame: numpy.ndarray) -> numpy.ndarray:
+        """
+        Record the current of a frame and return the frame to show.
+
+        :param pixels: The (n, bpp) uint8 pixel buffer including any white channel.
+        :param frame: The (n, 3) uint8 RGB frame to show.
+        """
+        current = float(self._model.frame_currents(pixels[None])[0])
+        self._currents.append(current)
+        if current <= self._budget:
+            return frame
+        if not self._warned:
+            self._warned = True
+            print(
+                f"Warning: frame {len(self._currents) - 1} draws about {current:.0f}mA "
+                f"which is over the power budget of {self._budget:.0f}mA."
+            )
+        if not self._auto_scale:
+            return frame
+        factor = self._model.scale_factors(pixels[None], self._budget)
+        return scale_frames(frame[None], factor)[0]
+
+    def summary(self) -> str:
+        if not self._currents:
+            return "Power: no frames shown."
+        currents = numpy.asarray(self._currents)
+        return (
+            f"Power: peak {currents.max():.0f}mA average {currents.mean():.0f}mA. "
+            f"{numpy.count_nonzero(currents > self._budget)} of {len(currents)} frames "
+            f"over the {self._budget:.0f}mA budget."
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Estimate the current drawn by an animation file."
+    )
+    parser.add_argument("path", type=str, help="The animation file to check.")
+    parser.add_argument(
+        "--budget",
+        type=float,
+        help="The maximum current of the power supply in milliamps. Frames above this are reported.",
+    )
+    parser.add_argument(
+        "--milliamps-per-channel",
+        type=float,
+        default=MILLIAMPS_PER_CHANNEL,
+        help="The current each channel draws at full brightness.",
+    )
+    parser.add_argument(
+        "--idle-milliamps",
+        type=float,
+        default=IDLE_MILLIAMPS,
+        help="The current each LED draws when it is off.",
+    )
+    parser.add_argument(
+        "--scale-to",
+        type=str,
+        help="Write the animation to this path with the frames over budget dimmed to fit the budget.",
+    )
+    parser.add_argument("--json", type=str, help="Save the report as JSON to this path.")
+    args = parser.parse_args()
+    report = analyse_animation(
+        args.path,
+        PowerModel(args.milliamps_per_channel, args.idle_milliamps),
+        args.budget,
+        args.scale_to,
+    )
+    print(
+        f"Frames: {report['frames']}  Peak: {report['peak_milliamps']:.0f}mA (frame {report['peak_frame']})  "
+        f"Average: {report['average_milliamps']}mA"
+    )
+    if args.budget is not None:
+        indexes = report["over_budget_frame_indexes"]
+        print(
+            f"{report['over_budget_frames']} frames over the {args.budget:.0f}mA budget"
+            + (f": {indexes[:20]}{' ...' if len(indexes) > 20 else ''}" if indexes else ".")
+        )
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()